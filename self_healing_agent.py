@@ -10,14 +10,20 @@ no matter what goes wrong internally.
 """
 
 import asyncio
+import copy
+import functools
 import logging
-from typing import Dict, Any, Optional, List, Callable
-from dataclasses import dataclass, field
+import math
+import re
+import sys
+import time
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, List, Callable, Tuple, Mapping, Final
+from dataclasses import dataclass
 from datetime import datetime
-import traceback
 
 # Import our error recovery components
-from error_classification import ErrorClassifier, error_classifier, ErrorCategory, ErrorSeverity
+from error_classification import ErrorClassifier, error_classifier, ErrorCategory, ErrorSeverity, ClassifiedError
 from retry_mechanism import async_retry, RetryPolicies, CircuitBreakerOpenError
 from circuit_breaker import CircuitBreaker, CircuitBreakerPresets, circuit_breaker_registry
 from fallback_chain import AIFallbackChain, DegradedModeHandler, ModelConfig, ModelTier
@@ -27,15 +33,199 @@ from user_messages import UserMessageManager, UserMessage
 
 logger = logging.getLogger(__name__)
 
+@dataclass(slots=True)
+class RequestCtx:
+    """Per-message request context, shared by every helper via _REQ"""
+    user_id: str
+    chat_id: str
+    deadline: float  # Absolute time.monotonic() deadline
+    message_text: str = ""
+    attachments: Optional[List] = None
+    state: Optional[SessionState] = None
 
-@dataclass
+
+# Context of the message currently being processed
+_REQ: ContextVar[RequestCtx] = ContextVar("req")
+
+
+def _remaining() -> float:
+    """Seconds left before the current request's deadline (inf if none set)"""
+    ctx = _REQ.get(None)
+    if ctx is None:
+        return float("inf")
+    return ctx.deadline - time.monotonic()
+
+
+async def _with_deadline(coro):
+    """Await a coroutine, bounded by the remaining request deadline"""
+    remaining = _remaining()
+    if remaining == float("inf"):
+        return await coro
+    return await asyncio.wait_for(coro, timeout=max(0.05, remaining))
+
+
+class RetryScheduler:
+    """
+    Coalesces retry backoff sleeps into shared wakeups
+    
+    Wakeup times are rounded up to ``resolution`` buckets, so all retries
+    due in the same bucket wait on one future and one loop timer instead of
+    each scheduling their own.
+    """
+    
+    def __init__(self, resolution: float = 0.1):
+        self._resolution = resolution
+        self._buckets: Dict[int, asyncio.Future] = {}
+    
+    async def sleep_for(self, delay: float):
+        """Sleep for at least ``delay`` seconds"""
+        loop = asyncio.get_running_loop()
+        await self.sleep_until(loop.time() + delay)
+    
+    async def sleep_until(self, deadline: float):
+        """Sleep until ``deadline`` (in loop.time() units), rounded up to a bucket"""
+        loop = asyncio.get_running_loop()
+        bucket = math.ceil(deadline / self._resolution)
+        future = self._buckets.get(bucket)
+        if future is None or future.done() or future.get_loop() is not loop:
+            future = loop.create_future()
+            self._buckets[bucket] = future
+            loop.call_at(bucket * self._resolution, self._wake, bucket, future)
+        # Shield so one cancelled waiter doesn't cancel the shared future
+        await asyncio.shield(future)
+    
+    def _wake(self, bucket: int, future: asyncio.Future):
+        if self._buckets.get(bucket) is future:
+            del self._buckets[bucket]
+        if not future.done():
+            future.set_result(None)
+
+
+# Global retry scheduler shared by the agent and the self_healing decorator
+retry_scheduler = RetryScheduler()
+
+
+# Minimum seconds between two identical warnings (protects against log storms)
+_WARN_INTERVAL = 1.0
+# (msg_id, error type) -> [last logged at, warnings suppressed since]
+_last_warned: Dict[Tuple[str, str], List] = {}
+
+
+def _warn_throttled(msg_id: str, msg: str, *args):
+    """
+    Log a warning at most once per _WARN_INTERVAL for a given msg_id and
+    error type (taken from the first exception in args); the next warning
+    logged reports how many were suppressed in between.
+    """
+    if not logger.isEnabledFor(logging.WARNING):
+        return
+    error_type = next((type(a).__name__ for a in args if isinstance(a, BaseException)), "")
+    key = (msg_id, error_type)
+    now = time.monotonic()
+    entry = _last_warned.get(key)
+    if entry is None:
+        _last_warned[key] = [now, 0]
+    elif now - entry[0] > _WARN_INTERVAL:
+        if entry[1]:
+            msg += " (%d similar warnings suppressed)"
+            args += (entry[1],)
+        entry[0], entry[1] = now, 0
+    else:
+        entry[1] += 1
+        return
+    logger.warning(msg, *args)
+
+
+# (key, template) pairs shown to the user after extraction, in display order
+_EXTRACTION_FIELDS = (
+    ("vendor", "🏢 Vendor: {}"),
+    ("amount", "💰 Amount: ${}"),
+    ("date", "📅 Date: {}"),
+)
+
+
+@dataclass(slots=True, frozen=True)
 class AgentResponse:
-    """Standard response from the agent"""
+    """
+    Standard response from the agent
+    
+    Immutable - use dataclasses.replace() to attach metadata.
+    """
     text: str
     success: bool
     used_fallback: bool = False
     error_logged: bool = False
-    metadata: Dict[str, Any] = field(default_factory=dict)
+    metadata: Optional[Mapping[str, Any]] = None
+    
+    @property
+    def metadata_dict(self) -> Dict[str, Any]:
+        """Metadata as a plain dict (empty if none was attached)"""
+        return dict(self.metadata) if self.metadata else {}
+
+
+def idempotent(flag: bool = True):
+    """
+    Mark an operation as safe (or unsafe) to retry
+    
+    Non-idempotent operations run once and go straight to fallback on failure.
+    """
+    def decorator(func: Callable) -> Callable:
+        func.idempotent = flag
+        return func
+    return decorator
+
+
+# Rule-based replies used when the AI model is unavailable
+_HELP_TEXT: Final[str] = """Here's what I can help you with:
+
+📤 **Upload Invoice** - Send me a photo or PDF of your invoice
+📋 **View Invoices** - See all your saved invoices
+📊 **Reports** - Generate expense reports
+⚙️ **Settings** - Configure your preferences
+
+Just send me an invoice to get started!"""
+_GREET_TEXT: Final[str] = "Hello! 👋 I'm your invoice assistant. Send me an invoice and I'll help you process it!"
+_DEFAULT_TEXT: Final[str] = "I'm here to help with your invoices! Try uploading a document or type /help for options."
+
+# Single-pass intent detection. Keywords match whole words only ("this" is
+# not a greeting, "show" is not a help request); a "?" anywhere asks for
+# help, and help takes precedence over greetings.
+_INTENT_RE = re.compile(
+    r"(?P<help>\b(?:help|how)\b|\?)|(?P<greet>\b(?:hello|hi|hey)\b)",
+    re.IGNORECASE
+)
+
+
+# Static last-resort responses, shared across calls (AgentResponse is frozen)
+_ULTIMATE_FALLBACKS: Dict[str, AgentResponse] = {
+    "_handle_document_upload": AgentResponse(
+        text="""I apologize, but I'm having trouble processing your document right now.
+
+Here are your options:
+1. 🔄 Try uploading again in a moment
+2. 📝 Type the invoice details manually
+3. ❓ Type /help for assistance
+
+I'm still here to help you!""",
+        success=True,
+        used_fallback=True
+    ),
+    "_handle_text_message": AgentResponse(
+        text="""I'm experiencing a brief technical issue. 
+
+Could you try your request again? I'm still here to help with your invoices!
+
+Type /help if you need assistance.""",
+        success=True,
+        used_fallback=True
+    ),
+}
+
+_DEFAULT_ULTIMATE = AgentResponse(
+    text="I'm here to help! Could you try that again?",
+    success=True,
+    used_fallback=True
+)
 
 
 class SelfHealingInvoiceAgent:
@@ -51,6 +241,16 @@ class SelfHealingInvoiceAgent:
     5. Static responses (ultimate fallback)
     """
     
+    # Retry policy for the primary execution layer
+    MAX_RETRIES = 3
+    BASE_DELAY = 1.0
+    
+    # Seconds a health snapshot is reused between scrapes
+    HEALTH_CACHE_TTL = 1.0
+    
+    # Time budget for replaying a failed message from the DLQ
+    DLQ_REPLAY_DEADLINE = 30.0
+    
     def __init__(self):
         # Initialize all recovery components
         self.error_classifier = error_classifier
@@ -62,6 +262,16 @@ class SelfHealingInvoiceAgent:
         
         # Circuit breakers for different services
         self.circuit_breakers: Dict[str, CircuitBreaker] = {}
+        # Hot-path breakers, bound once in _setup_circuit_breakers
+        self._cb_ai: Optional[CircuitBreaker] = None
+        self._cb_file: Optional[CircuitBreaker] = None
+        self._cb_db: Optional[CircuitBreaker] = None
+        
+        # Fire-and-forget tasks (kept referenced until done)
+        self._background_tasks: set = set()
+        
+        # Last health snapshot as (monotonic build time, status dict)
+        self._health_cache: Optional[Tuple[float, Dict[str, Any]]] = None
         
         # Track agent health
         self._health_status = {
@@ -71,13 +281,23 @@ class SelfHealingInvoiceAgent:
             "external_apis": "healthy",
         }
         
-        self._initialized = False
+        # Set once initialization has run; the lock makes concurrent
+        # first messages share a single initialization
+        self._init_event = asyncio.Event()
+        self._init_lock = asyncio.Lock()
     
     async def initialize(self):
-        """Initialize all components"""
-        if self._initialized:
+        """Initialize all components (safe to call concurrently)"""
+        if self._init_event.is_set():
             return
         
+        async with self._init_lock:
+            if self._init_event.is_set():
+                return
+            await self._initialize_components()
+    
+    async def _initialize_components(self):
+        """Build all recovery components - called once, under _init_lock"""
         try:
             # Initialize state manager
             self.state_manager = create_state_manager(
@@ -90,6 +310,9 @@ class SelfHealingInvoiceAgent:
             # Initialize DLQ
             self.dlq = DeadLetterQueue(storage_path="./dlq_storage")
             await self.dlq.initialize()
+            # Register before starting: items left from a previous run would
+            # otherwise be discarded as unhandled on the first pass
+            self._register_dlq_handlers()
             await self.dlq.start_processor()
             
             # Initialize fallback chain
@@ -99,13 +322,13 @@ class SelfHealingInvoiceAgent:
             # Initialize circuit breakers
             self._setup_circuit_breakers()
             
-            self._initialized = True
+            self._init_event.set()
             logger.info("Self-healing agent initialized successfully")
             
         except Exception as e:
-            logger.error(f"Failed to initialize agent: {e}")
+            logger.error("Failed to initialize agent: %s", e)
             # Even initialization failure shouldn't stop us
-            self._initialized = True
+            self._init_event.set()
     
     def _setup_circuit_breakers(self):
         """Setup circuit breakers for external services"""
@@ -119,6 +342,10 @@ class SelfHealingInvoiceAgent:
         
         for name, config in services:
             self.circuit_breakers[name] = circuit_breaker_registry.get_or_create(name, config)
+        
+        self._cb_ai = self.circuit_breakers["ai_model"]
+        self._cb_file = self.circuit_breakers["file_service"]
+        self._cb_db = self.circuit_breakers["database"]
     
     def _setup_ai_models(self):
         """Setup AI models in fallback chain"""
@@ -131,45 +358,49 @@ class SelfHealingInvoiceAgent:
         user_id: str,
         chat_id: str,
         message_text: str,
-        attachments: Optional[List] = None
+        attachments: Optional[List] = None,
+        deadline_seconds: float = 8.0
     ) -> AgentResponse:
         """
         Process a user message - NEVER FAILS
         
-        This is the main entry point that guarantees a response
+        This is the main entry point that guarantees a response.
+        All internal work (retries, fallbacks, degraded mode) shares a single
+        end-to-end budget of ``deadline_seconds``.
         """
-        session_id = f"{user_id}:{chat_id}"
-        
+        ctx_token = None
         try:
+            # Telegram ids repeat across messages - intern them (callers may
+            # pass ints) and key the session on the (user_id, chat_id) tuple
+            user_id = sys.intern(str(user_id))
+            chat_id = sys.intern(str(chat_id))
+            session_key = (user_id, chat_id)
+            ctx = RequestCtx(
+                user_id=user_id,
+                chat_id=chat_id,
+                deadline=time.monotonic() + deadline_seconds,
+                message_text=message_text,
+                attachments=attachments,
+            )
+            ctx_token = _REQ.set(ctx)
+            
             # Ensure initialization
-            if not self._initialized:
+            if not self._init_event.is_set():
                 await self.initialize()
             
             # Load or create session state
-            state = await self._get_session_state(session_id, user_id, chat_id)
+            ctx.state = await self._get_session_state(session_key)
             
             # Process based on message type
             if attachments:
-                return await self._process_with_full_recovery(
-                    self._handle_document_upload,
-                    user_id=user_id,
-                    chat_id=chat_id,
-                    attachments=attachments,
-                    state=state
-                )
+                return await self._process_with_full_recovery(self._handle_document_upload)
             else:
-                return await self._process_with_full_recovery(
-                    self._handle_text_message,
-                    user_id=user_id,
-                    chat_id=chat_id,
-                    message_text=message_text,
-                    state=state
-                )
+                return await self._process_with_full_recovery(self._handle_text_message)
         
         except Exception as e:
             # Ultimate fallback - should never reach here
-            logger.critical(f"Ultimate fallback triggered: {e}")
-            logger.critical(traceback.format_exc())
+            # exc_info defers traceback formatting to the handler
+            logger.critical("Ultimate fallback triggered: %s", e, exc_info=True)
             
             return AgentResponse(
                 text="I'm here to help! Could you try that again?",
@@ -177,34 +408,34 @@ class SelfHealingInvoiceAgent:
                 used_fallback=True,
                 error_logged=True
             )
+        finally:
+            if ctx_token is not None:
+                _REQ.reset(ctx_token)
     
-    async def _get_session_state(
-        self, 
-        session_id: str, 
-        user_id: str, 
-        chat_id: str
-    ) -> SessionState:
+    async def _get_session_state(self, session_key: Tuple[str, str]) -> SessionState:
         """Get or create session state"""
+        # The persistence layers key sessions by string; it's built once
+        # here and then carried on the state as session_id
+        session_id = "{}:{}".format(*session_key)
         if self.state_manager:
-            state = await self.state_manager.load_state(session_id)
+            state = await _with_deadline(self.state_manager.load_state(session_id))
             if state:
                 return state
         
         # Create new state
+        user_id, chat_id = session_key
         return SessionState(
             session_id=session_id,
             user_id=user_id,
             chat_id=chat_id
         )
     
-    async def _process_with_full_recovery(
-        self,
-        operation: Callable,
-        **kwargs
-    ) -> AgentResponse:
+    async def _process_with_full_recovery(self, operation: Callable) -> AgentResponse:
         """
         Execute an operation with full error recovery
         
+        The operation takes no arguments; it reads the current RequestCtx.
+        
         Layers of protection:
         1. Try the operation normally
         2. If it fails, classify the error
@@ -214,26 +445,27 @@ class SelfHealingInvoiceAgent:
         6. Ultimate static response if all else fails
         """
         last_error = None
+        classified = None
         
         # Layer 1: Try normal execution with retry
         try:
-            result = await self._execute_with_retry(operation, **kwargs)
+            result = await self._execute_with_retry(operation)
             if result:
                 return AgentResponse(text=result, success=True)
         except Exception as e:
             last_error = e
-            logger.warning(f"Primary execution failed: {e}")
+            _warn_throttled("primary_failed", "Primary execution failed: %s", e)
         
         # Layer 2: Classify error and get user-friendly message
         if last_error:
             classified = self.error_classifier.classify(last_error)
-            logger.info(f"Error classified: {classified.category.value}, "
-                       f"retryable: {classified.is_retryable}")
+            logger.info("Error classified: %s, retryable: %s",
+                        classified.category.value, classified.is_retryable)
         
         # Layer 3: Try fallback AI model
         try:
-            fallback_result = await self._execute_with_fallback_model(
-                operation, **kwargs
+            fallback_result = await _with_deadline(
+                self._execute_with_fallback_model(operation)
             )
             if fallback_result:
                 return AgentResponse(
@@ -242,11 +474,13 @@ class SelfHealingInvoiceAgent:
                     used_fallback=True
                 )
         except Exception as e:
-            logger.warning(f"Fallback model failed: {e}")
+            _warn_throttled("fallback_failed", "Fallback model failed: %s", e)
         
         # Layer 4: Use degraded mode
         try:
-            degraded_result = await self._execute_degraded(operation, **kwargs)
+            degraded_result = await _with_deadline(
+                self._execute_degraded(operation)
+            )
             if degraded_result:
                 return AgentResponse(
                     text=degraded_result,
@@ -254,35 +488,118 @@ class SelfHealingInvoiceAgent:
                     used_fallback=True
                 )
         except Exception as e:
-            logger.warning(f"Degraded mode failed: {e}")
+            _warn_throttled("degraded_failed", "Degraded mode failed: %s", e)
         
         # Layer 5: Ultimate static response
+        if last_error:
+            self._send_to_dlq(operation, last_error, classified)
         return self._get_ultimate_fallback_response(operation.__name__)
     
-    async def _execute_with_retry(self, operation: Callable, **kwargs) -> str:
+    def _send_to_dlq(
+        self,
+        operation: Callable,
+        error: Exception,
+        classified: Optional[ClassifiedError]
+    ):
+        """Record an unrecoverable failure in the DLQ without blocking the reply"""
+        if not self.dlq:
+            return
+        
+        ctx = _REQ.get(None)
+        payload = {
+            "user_id": ctx.user_id if ctx else None,
+            "chat_id": ctx.chat_id if ctx else None,
+            "operation": operation.__name__,
+            "message_text": ctx.message_text if ctx else None,
+            "attachments": ctx.attachments if ctx else None,
+            "error": repr(error),
+            "classified": classified.category.value if classified else None,
+            "retry_count": self._max_retries_for(operation),
+            "ts": time.time(),
+        }
+        task = asyncio.create_task(self.dlq.enqueue(
+            operation_type=operation.__name__,
+            payload=payload,
+            error=error,
+        ))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_dlq_enqueued)
+    
+    def _register_dlq_handlers(self):
+        """Let the DLQ processor replay failed messages once services recover"""
+        for operation in (self._handle_text_message, self._handle_document_upload):
+            self.dlq.register_handler(
+                operation.__name__,
+                functools.partial(self._replay_from_dlq, operation)
+            )
+    
+    async def _replay_from_dlq(self, operation: Callable, payload: Dict[str, Any]) -> bool:
+        """
+        DLQ handler: re-run a failed message against its session
+        
+        This brings the session state up to date; the reply itself is not
+        re-sent. Raising (or returning False) makes the DLQ schedule another
+        attempt with backoff.
+        """
+        session_key = (sys.intern(payload["user_id"]), sys.intern(payload["chat_id"]))
+        ctx = RequestCtx(
+            user_id=session_key[0],
+            chat_id=session_key[1],
+            deadline=time.monotonic() + self.DLQ_REPLAY_DEADLINE,
+            message_text=payload.get("message_text") or "",
+            attachments=payload.get("attachments"),
+        )
+        ctx_token = _REQ.set(ctx)
+        try:
+            ctx.state = await self._get_session_state(session_key)
+            return bool(await self._execute_with_retry(operation))
+        finally:
+            _REQ.reset(ctx_token)
+    
+    def _on_dlq_enqueued(self, task: asyncio.Task):
+        """Log DLQ enqueue failures - they must never reach the user"""
+        self._background_tasks.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error:
+            logger.error("Failed to enqueue to DLQ: %s", error)
+    
+    def _max_retries_for(self, operation: Callable) -> int:
+        """Only idempotent operations are retried"""
+        return self.MAX_RETRIES if getattr(operation, "idempotent", True) else 0
+    
+    async def _execute_with_retry(self, operation: Callable) -> str:
         """Execute with automatic retry"""
-        max_retries = 3
-        base_delay = 1.0
+        max_retries = self._max_retries_for(operation)
+        base_delay = self.BASE_DELAY
         
         for attempt in range(max_retries + 1):
             try:
-                return await operation(**kwargs)
+                return await _with_deadline(operation())
             except Exception as e:
                 if attempt < max_retries:
                     delay = base_delay * (2 ** attempt)
-                    logger.warning(f"Attempt {attempt + 1} failed, retrying in {delay}s...")
-                    await asyncio.sleep(delay)
+                    # Don't sleep into a retry the deadline won't let us finish
+                    if _remaining() <= delay + 0.1:
+                        raise
+                    _warn_throttled(
+                        "retry_attempt",
+                        "Attempt %d failed: %s, retrying in %.2fs...",
+                        attempt + 1, e, delay
+                    )
+                    await retry_scheduler.sleep_for(delay)
                 else:
                     raise
     
-    async def _execute_with_fallback_model(self, operation: Callable, **kwargs) -> str:
+    async def _execute_with_fallback_model(self, operation: Callable) -> str:
         """Execute using fallback AI model"""
         # This would use the fallback chain
         # response = await self.fallback_chain.generate(...)
         # return response.content
         raise Exception("Fallback model not available")
     
-    async def _execute_degraded(self, operation: Callable, **kwargs) -> str:
+    async def _execute_degraded(self, operation: Callable) -> str:
         """Execute in degraded mode"""
         # Use simplified processing
         # degraded_handler = DegradedModeHandler()
@@ -291,52 +608,22 @@ class SelfHealingInvoiceAgent:
     
     def _get_ultimate_fallback_response(self, operation_name: str) -> AgentResponse:
         """Get the ultimate fallback response that never fails"""
-        responses = {
-            "_handle_document_upload": AgentResponse(
-                text="""I apologize, but I'm having trouble processing your document right now.
-
-Here are your options:
-1. 🔄 Try uploading again in a moment
-2. 📝 Type the invoice details manually
-3. ❓ Type /help for assistance
-
-I'm still here to help you!""",
-                success=True,
-                used_fallback=True
-            ),
-            "_handle_text_message": AgentResponse(
-                text="""I'm experiencing a brief technical issue. 
-
-Could you try your request again? I'm still here to help with your invoices!
-
-Type /help if you need assistance.""",
-                success=True,
-                used_fallback=True
-            ),
-        }
-        
-        return responses.get(operation_name, AgentResponse(
-            text="I'm here to help! Could you try that again?",
-            success=True,
-            used_fallback=True
-        ))
+        return _ULTIMATE_FALLBACKS.get(operation_name, _DEFAULT_ULTIMATE)
     
-    async def _handle_document_upload(
-        self,
-        user_id: str,
-        chat_id: str,
-        attachments: List,
-        state: SessionState
-    ) -> str:
+    @idempotent(False)  # Downloads the file and mutates session state
+    async def _handle_document_upload(self) -> str:
         """Handle document upload - with circuit breaker protection"""
+        ctx = _REQ.get()
+        state = ctx.state
+        
         # Check circuit breaker
-        cb = self.circuit_breakers.get("file_service")
+        cb = self._cb_file
         if cb and not cb.can_execute():
             raise Exception("File service circuit breaker is open")
         
         try:
             # Download file
-            file_path = await self._download_file(attachments[0])
+            file_path = await self._download_file(ctx.attachments[0])
             
             # Process document
             extracted_data = await self._extract_invoice_data(file_path)
@@ -344,6 +631,8 @@ Type /help if you need assistance.""",
             # Update state
             state.extracted_data = extracted_data
             state.current_step = "awaiting_confirmation"
+            # Only the memory layer is written inline; the state manager's
+            # write-back task persists the rest without making the user wait
             if self.state_manager:
                 await self.state_manager.save_state(state)
             
@@ -358,16 +647,15 @@ Type /help if you need assistance.""",
                 cb.record_failure()
             raise
     
-    async def _handle_text_message(
-        self,
-        user_id: str,
-        chat_id: str,
-        message_text: str,
-        state: SessionState
-    ) -> str:
+    @idempotent(True)
+    async def _handle_text_message(self) -> str:
         """Handle text message - with AI fallback chain"""
+        ctx = _REQ.get()
+        state = ctx.state
+        message_text = ctx.message_text
+        
         # Check AI model circuit breaker
-        cb = self.circuit_breakers.get("ai_model")
+        cb = self._cb_ai
         if cb and not cb.can_execute():
             # Use static response if circuit is open
             return self._get_static_text_response(message_text)
@@ -396,6 +684,14 @@ Type /help if you need assistance.""",
                 cb.record_failure()
             raise
     
+    async def shutdown(self):
+        """Flush pending state and stop background workers"""
+        if self.state_manager:
+            await self.state_manager.close()
+        
+        if self.dlq:
+            await self.dlq.stop_processor()
+    
     async def _download_file(self, attachment: Dict) -> str:
         """Download file with retry"""
         # Implementation with retry logic
@@ -414,47 +710,49 @@ Type /help if you need assistance.""",
     
     def _format_extraction(self, data: Dict) -> str:
         """Format extracted data for user"""
-        parts = []
-        if data.get("vendor"):
-            parts.append(f"🏢 Vendor: {data['vendor']}")
-        if data.get("amount"):
-            parts.append(f"💰 Amount: ${data['amount']}")
-        if data.get("date"):
-            parts.append(f"📅 Date: {data['date']}")
-        return "\n".join(parts)
+        return "\n".join(
+            template.format(value)
+            for key, template in _EXTRACTION_FIELDS
+            if (value := data.get(key))
+        )
     
     def _get_static_text_response(self, message_text: str) -> str:
         """Get static response when AI is unavailable"""
-        # Simple rule-based responses
-        text_lower = message_text.lower()
+        greeted = False
+        for match in _INTENT_RE.finditer(message_text):
+            if match.lastgroup == "help":
+                return _HELP_TEXT
+            greeted = True
         
-        if any(word in text_lower for word in ["help", "?", "how"]):
-            return """Here's what I can help you with:
-
-📤 **Upload Invoice** - Send me a photo or PDF of your invoice
-📋 **View Invoices** - See all your saved invoices
-📊 **Reports** - Generate expense reports
-⚙️ **Settings** - Configure your preferences
-
-Just send me an invoice to get started!"""
-        
-        elif any(word in text_lower for word in ["hello", "hi", "hey"]):
-            return "Hello! 👋 I'm your invoice assistant. Send me an invoice and I'll help you process it!"
-        
-        else:
-            return "I'm here to help with your invoices! Try uploading a document or type /help for options."
+        return _GREET_TEXT if greeted else _DEFAULT_TEXT
     
     async def get_health_status(self) -> Dict[str, Any]:
-        """Get comprehensive health status"""
-        return {
-            "agent_initialized": self._initialized,
-            "service_health": self._health_status,
-            "circuit_breakers": {
-                name: cb.get_status()
-                for name, cb in self.circuit_breakers.items()
-            },
-            "timestamp": datetime.now().isoformat(),
-        }
+        """
+        Get comprehensive health status
+        
+        Snapshots are reused for HEALTH_CACHE_TTL seconds so frequent scrapes
+        don't poll every circuit breaker; "cache_age" is the snapshot's age
+        in seconds.
+        """
+        now = time.monotonic()
+        if not self._health_cache or now - self._health_cache[0] >= self.HEALTH_CACHE_TTL:
+            self._health_cache = (now, {
+                "agent_initialized": self._init_event.is_set(),
+                "circuit_breakers": {
+                    name: cb.get_status()
+                    for name, cb in self.circuit_breakers.items()
+                },
+                "timestamp": datetime.now().isoformat(),
+            })
+        
+        built_at, snapshot = self._health_cache
+        # Callers get their own copy (breaker statuses nest further dicts);
+        # service_health is always current
+        status = dict(snapshot)
+        status["circuit_breakers"] = copy.deepcopy(snapshot["circuit_breakers"])
+        status["service_health"] = dict(self._health_status)
+        status["cache_age"] = now - built_at
+        return status
 
 
 # Decorator for adding self-healing to any function
@@ -483,14 +781,14 @@ def self_healing(
                     last_error = e
                     if attempt < retry_count:
                         delay = 1.0 * (2 ** attempt)
-                        await asyncio.sleep(delay)
+                        await retry_scheduler.sleep_for(delay)
             
             # Try fallback function
             if fallback_function:
                 try:
                     return await fallback_function(*args, **kwargs)
                 except Exception as e:
-                    logger.error(f"Fallback function also failed: {e}")
+                    logger.error("Fallback function also failed: %s", e)
             
             # Return user-friendly error
             message = UserMessageManager.get_message(error_message_key)
@@ -517,6 +815,8 @@ async def main():
     # Get health status
     health = await agent.get_health_status()
     print(f"Health: {health}")
+    
+    await agent.shutdown()
 
 
 if __name__ == "__main__":
@@ -10,22 +10,234 @@ or restarts. It provides multiple persistence layers for maximum reliability.
 """
 
 import json
-import pickle
 import asyncio
-import aiofiles
 import logging
-from typing import Dict, Any, Optional, List, Callable, Union
+from typing import Dict, Any, Optional, List, Callable, Union, Set, Tuple, AsyncIterator
 from dataclasses import dataclass, field, asdict
 from datetime import datetime, timedelta
 from pathlib import Path
 import hashlib
+import mmap
 import os
 import shutil
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+from functools import lru_cache
+from weakref import WeakValueDictionary
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
+def _json_default(obj: Any) -> Any:
+    """Fallback serializer for the stdlib json path"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _dumps(obj: Any, pretty: bool = False) -> bytes:
+    """Serialize to JSON bytes - orjson when available (native datetimes)"""
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, indent=2, default=_json_default).encode()
+    return json.dumps(obj, separators=(",", ":"), default=_json_default).encode()
+
+
+def _loads(data: Union[bytes, str]) -> Any:
+    """Parse JSON bytes or str"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@lru_cache(maxsize=4096)
+def _safe_key(key: str) -> str:
+    """Filesystem-safe file name stem for a session key (cached per key)"""
+    # md5 is kept so files written by earlier versions stay addressable
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def _write_atomic(path: Path, data: bytes):
+    """Write to a temp file, then rename over the target (atomic on POSIX)"""
+    temp_path = path.with_suffix('.tmp')
+    temp_path.write_bytes(data)
+    os.replace(temp_path, path)
+
+
+def _link_or_copy(src: Path, dst: Path):
+    """
+    Hard-link src to dst (no data copied); fall back to a copy where links
+    aren't supported. Safe because the live file is always replaced by
+    rename, which never modifies the linked inode.
+    """
+    try:
+        os.link(src, dst)
+    except (FileExistsError, FileNotFoundError):
+        # Backup already taken, or nothing to back up yet
+        pass
+    except OSError:
+        shutil.copy(src, dst)
+
+
+def _backups_newest_first(backup_dir: Path, safe_key: str) -> List[Path]:
+    """Backups of one session, ordered by the version in their name (no stat calls)"""
+    prefix = f"{safe_key}_v"
+    versioned = []
+    for path in backup_dir.glob(f"{prefix}*.json"):
+        try:
+            versioned.append((int(path.stem[len(prefix):]), path))
+        except ValueError:
+            continue
+    versioned.sort(key=lambda item: item[0], reverse=True)
+    return [path for _, path in versioned]
+
+
+def _take_backup(src: Path, backup_path: Path, safe_key: str, keep: int):
+    """Link a new backup into place and prune all but the newest `keep`"""
+    _link_or_copy(src, backup_path)
+    for old in _backups_newest_first(backup_path.parent, safe_key)[keep:]:
+        old.unlink(missing_ok=True)
+
+
+def _read_if_exists(path: Path) -> Optional[bytes]:
+    """Read a whole file, or None if it doesn't exist"""
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+# Conversation history log next to each state file ("<hash>.history.ndjson")
+_HISTORY_LOG_SUFFIX = ".history.ndjson"
+
+
+def _history_log_path(file_path: Path) -> Path:
+    return file_path.with_suffix(_HISTORY_LOG_SUFFIX)
+
+
+def _write_state_files(file_path: Path, record: bytes, history: bytes, append: bool):
+    """
+    Append (or atomically rewrite) the history log, then replace the main
+    record. The log is written first so a record never points past it.
+    """
+    log_path = _history_log_path(file_path)
+    if not append:
+        _write_atomic(log_path, history)
+    elif history:
+        with open(log_path, "ab") as f:
+            f.write(history)
+    _write_atomic(file_path, record)
+
+
+# History logs at least this large are parsed from an mmap instead of read()
+_MMAP_THRESHOLD = 4096
+
+
+def _mapped_lines(mm: mmap.mmap, view: memoryview) -> List[memoryview]:
+    """Zero-copy line slices of a mapped log (a torn final line is kept)"""
+    lines = []
+    start = 0
+    end = mm.find(b"\n")
+    while end != -1:
+        lines.append(view[start:end])
+        start = end + 1
+        end = mm.find(b"\n", start)
+    if start < len(mm):
+        lines.append(view[start:])
+    return lines
+
+
+def _load_state_files(
+    file_path: Path,
+    record_path: Optional[Path] = None
+) -> Optional[Tuple['SessionState', Optional[int]]]:
+    """
+    Read and parse a state record (file_path, or record_path when restoring
+    a backup) plus the history log of file_path. Runs in a worker thread.
+    """
+    record = _read_if_exists(record_path or file_path)
+    if record is None:
+        return None
+    failure = None
+    try:
+        with open(_history_log_path(file_path), "rb") as f:
+            if ORJSON_AVAILABLE and os.fstat(f.fileno()).st_size >= _MMAP_THRESHOLD:
+                # orjson parses each entry straight out of the page cache
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with memoryview(mm) as view:
+                        try:
+                            return _state_from_record(record, _mapped_lines(mm, view))
+                        except Exception as e:
+                            # Its traceback pins slices of the mapping, which
+                            # then can't be closed - re-raise after unmapping
+                            failure = repr(e)
+                raise ValueError(f"Unreadable state {file_path}: {failure}")
+            log = f.read()
+    except FileNotFoundError:
+        return _state_from_record(record, None)
+    
+    lines = log.split(b"\n")
+    if not lines[-1]:
+        lines.pop()
+    # A torn final append stays in, so the length check forces a rewrite
+    return _state_from_record(record, lines)
+
+
+def _unlink_state_files(file_path: Path):
+    """Remove a state file and its history log"""
+    file_path.unlink(missing_ok=True)
+    _history_log_path(file_path).unlink(missing_ok=True)
+
+
+# Serialized states above this size are zstd-compressed when zstandard is installed
+_COMPRESS_THRESHOLD = 1024
+# Leading byte of a compressed payload (plain JSON always starts with "{")
+_ZSTD_MARKER = b"Z"
+
+if ZSTD_AVAILABLE:
+    # Only used from the event loop thread (compressors aren't thread-safe)
+    _zstd_compressor = zstandard.ZstdCompressor(level=3)
+
+
+def _compress(data: bytes) -> bytes:
+    """Compress large JSON payloads; small ones are stored as-is"""
+    if ZSTD_AVAILABLE and len(data) > _COMPRESS_THRESHOLD:
+        return _ZSTD_MARKER + _zstd_compressor.compress(data)
+    return data
+
+
+def _decompress(data: bytes) -> bytes:
+    """Inverse of _compress - plain JSON passes through unchanged"""
+    if data[:1] == _ZSTD_MARKER:
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("State is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data[1:])
+    return data
+
+
+def _to_datetime(value: Union[str, datetime]) -> datetime:
+    """Accept both serialized (ISO string) and native datetimes"""
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+@dataclass(slots=True)
 class SessionState:
     """Complete session state for persistence"""
     session_id: str
@@ -41,8 +253,8 @@ class SessionState:
     updated_at: datetime = field(default_factory=datetime.now)
     version: int = 1
     
-    def to_dict(self) -> Dict[str, Any]:
-        return {
+    def to_dict(self, exclude: Optional[Set[str]] = None) -> Dict[str, Any]:
+        data = {
             "session_id": self.session_id,
             "user_id": self.user_id,
             "chat_id": self.chat_id,
@@ -52,10 +264,30 @@ class SessionState:
             "current_step": self.current_step,
             "context": self.context,
             "metadata": self.metadata,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
             "version": self.version,
         }
+        if exclude:
+            for name in exclude:
+                data.pop(name, None)
+        return data
+    
+    def to_json(self, pretty: bool = False) -> bytes:
+        """Serialize to JSON bytes (orjson encodes the dataclass directly)"""
+        if ORJSON_AVAILABLE:
+            return _dumps(self, pretty=pretty)
+        return _dumps(self.to_dict(), pretty=pretty)
+    
+    def to_record(self) -> bytes:
+        """
+        Serialize everything except conversation_history, which persistent
+        layers keep in an append-only log; history_length says how many
+        log entries belong to this record.
+        """
+        data = self.to_dict(exclude=_HISTORY_FIELD)
+        data["history_length"] = len(self.conversation_history)
+        return _dumps(data)
     
     @classmethod
     def from_dict(cls, data: Dict) -> 'SessionState':
@@ -74,18 +306,113 @@ class SessionState:
         state.version = data.get("version", 1)
         
         if "created_at" in data:
-            state.created_at = datetime.fromisoformat(data["created_at"])
+            state.created_at = _to_datetime(data["created_at"])
         if "updated_at" in data:
-            state.updated_at = datetime.fromisoformat(data["updated_at"])
+            state.updated_at = _to_datetime(data["updated_at"])
         
         return state
     
-    def update_timestamp(self):
-        """Update the timestamp"""
-        self.updated_at = datetime.now()
+    def update_timestamp(self, now: Optional[datetime] = None):
+        """Update the timestamp (to `now` if the caller already has it)"""
+        self.updated_at = now or datetime.now()
         self.version += 1
 
 
+# Fields that change on every save and are ignored for dirty tracking
+_VOLATILE_FIELDS = frozenset({"updated_at", "version"})
+# Stored outside the main record, see SessionState.to_record
+_HISTORY_FIELD = frozenset({"conversation_history"})
+
+
+# What a layer knows is in a session's history log: (entry count, digest of those entries)
+_HistoryMark = Tuple[int, bytes]
+
+
+def _encode_history(entries: List[Dict]) -> List[bytes]:
+    """One compact JSON document per history entry (never contains a newline)"""
+    return [_dumps(entry) for entry in entries]
+
+
+def _update_history_digest(digest, lines) -> None:
+    for line in lines:
+        digest.update(line)
+        digest.update(b"\n")
+
+
+def _history_delta(
+    lines: List[bytes],
+    logged: Optional[_HistoryMark]
+) -> Tuple[Optional[int], _HistoryMark]:
+    """
+    Compare encoded history entries with what is already logged.
+
+    Returns the index to append from - None when the history is not a pure
+    append to the log (trimmed, edited in place, or log state unknown) and
+    the log must be rewritten - plus the mark for the log after the write.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if logged is None or logged[0] > len(lines):
+        _update_history_digest(digest, lines)
+        return None, (len(lines), digest.digest())
+    
+    length, logged_digest = logged
+    _update_history_digest(digest, lines[:length])
+    start = length if digest.digest() == logged_digest else None
+    _update_history_digest(digest, lines[length:])
+    return start, (len(lines), digest.digest())
+
+
+def _state_from_record(
+    record: bytes,
+    history: Optional[List[bytes]]
+) -> Tuple[SessionState, Optional[_HistoryMark]]:
+    """
+    Rebuild a state from its main record and history log entries.
+
+    Returns the state and the mark of the log it is consistent with, or None
+    when the log has to be rewritten in full on the next save (legacy
+    record with embedded history, or a log that doesn't match the pointer).
+    A damaged entry is handled like a torn tail: the history stops before it.
+    """
+    data = _loads(_decompress(record))
+    length = data.pop("history_length", None)
+    state = SessionState.from_dict(data)
+    if length is None:
+        return state, None
+
+    history = history or []
+    entries = history[:length]
+    for index, entry in enumerate(entries):
+        try:
+            state.conversation_history.append(_loads(entry))
+        except Exception as e:
+            logger.warning(
+                f"Dropping history of {state.session_id} from entry {index}: {e!r}"
+            )
+            return state, None
+    if len(history) != length:
+        return state, None
+    
+    digest = hashlib.blake2b(digest_size=16)
+    _update_history_digest(digest, entries)
+    return state, (length, digest.digest())
+
+
+class _KeyLocks:
+    """Per-session asyncio locks, dropped once nothing holds or waits on them"""
+    
+    def __init__(self):
+        self._locks: WeakValueDictionary = WeakValueDictionary()
+    
+    def __call__(self, key: str) -> asyncio.Lock:
+        """Get (or lazily create) the lock for a session key"""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+
 class StatePersistenceLayer:
     """Abstract base class for persistence layers"""
     
@@ -103,58 +430,137 @@ class StatePersistenceLayer:
     
     async def get_all_keys(self) -> List[str]:
         raise NotImplementedError
+    
+    async def iter_all(self) -> AsyncIterator[SessionState]:
+        """Yield every stored session (keys + load; override for a single pass)"""
+        for key in await self.get_all_keys():
+            state = await self.load(key)
+            if state:
+                yield state
+    
+    async def save_many(self, items: Dict[str, SessionState]) -> bool:
+        """Save several states; layers that can batch writes override this"""
+        results = await asyncio.gather(
+            *(self.save(key, state) for key, state in items.items())
+        )
+        return all(results)
+    
+    async def close(self):
+        """Release any resources held by the layer"""
+        pass
 
 
 class MemoryPersistenceLayer(StatePersistenceLayer):
     """In-memory persistence (fastest, but volatile)"""
     
+    # Share of max_size reserved for sessions hit more than once
+    PROTECTED_RATIO = 0.8
+    
     def __init__(self, max_size: int = 10000):
-        self._storage: Dict[str, SessionState] = {}
+        # Segmented LRU, both segments least recently used first: new keys
+        # enter probation and move to protected on their next hit, so a burst
+        # of one-off sessions can't flush out the regularly active ones
+        self._probation: OrderedDict[str, SessionState] = OrderedDict()
+        self._protected: OrderedDict[str, SessionState] = OrderedDict()
         self._max_size = max_size
-        self._access_times: Dict[str, datetime] = {}
+        self._protected_max = max(1, int(max_size * self.PROTECTED_RATIO))
+        # Serialized size per key, measured lazily for keys in _unsized
+        self._sizes: Dict[str, int] = {}
+        self._unsized: Set[str] = set()
+        self._bytes = 0
+    
+    def _hit(self, key: str) -> Optional[SessionState]:
+        """Look up a key and record the access (promotes probation entries)"""
+        state = self._protected.get(key)
+        if state is not None:
+            self._protected.move_to_end(key)
+            return state
+        
+        state = self._probation.pop(key, None)
+        if state is not None:
+            self._protected[key] = state
+            if len(self._protected) > self._protected_max:
+                # Demote protected LRU back to probation for a second chance
+                demoted_key, demoted = self._protected.popitem(last=False)
+                self._probation[demoted_key] = demoted
+        return state
     
     async def save(self, key: str, state: SessionState) -> bool:
-        # Evict oldest if at capacity
-        if len(self._storage) >= self._max_size and key not in self._storage:
-            oldest_key = min(self._access_times, key=self._access_times.get)
-            del self._storage[oldest_key]
-            del self._access_times[oldest_key]
-        
-        self._storage[key] = state
-        self._access_times[key] = datetime.now()
+        if self._hit(key) is not None:
+            self._protected[key] = state
+        else:
+            if len(self._probation) + len(self._protected) >= self._max_size:
+                # Evict least recently used, probation first
+                victims = self._probation or self._protected
+                evicted_key, _ = victims.popitem(last=False)
+                self._forget_size(evicted_key)
+            self._probation[key] = state
+        
+        self._forget_size(key)
+        self._unsized.add(key)
         return True
     
     async def load(self, key: str) -> Optional[SessionState]:
-        if key in self._storage:
-            self._access_times[key] = datetime.now()
-            return self._storage[key]
-        return None
+        return self._hit(key)
     
     async def delete(self, key: str) -> bool:
-        if key in self._storage:
-            del self._storage[key]
-            del self._access_times[key]
-            return True
-        return False
+        if self._protected.pop(key, None) is None and self._probation.pop(key, None) is None:
+            return False
+        self._forget_size(key)
+        return True
     
     async def exists(self, key: str) -> bool:
-        return key in self._storage
+        return key in self._protected or key in self._probation
     
     async def get_all_keys(self) -> List[str]:
-        return list(self._storage.keys())
+        return [*self._protected, *self._probation]
+    
+    async def iter_all(self) -> AsyncIterator[SessionState]:
+        # Snapshot so listing doesn't disturb LRU order
+        for state in [*self._protected.values(), *self._probation.values()]:
+            yield state
+    
+    def _forget_size(self, key: str):
+        """Drop a key from the memory accounting"""
+        self._bytes -= self._sizes.pop(key, 0)
+        self._unsized.discard(key)
     
     def get_memory_usage(self) -> int:
-        """Get approximate memory usage in bytes"""
-        return len(pickle.dumps(self._storage))
+        """
+        Get approximate memory usage in bytes (serialized size of all states)
+        
+        Only sessions saved since the last call are measured.
+        """
+        for key in self._unsized:
+            state = self._protected.get(key) or self._probation[key]
+            size = len(state.to_json())
+            self._sizes[key] = size
+            self._bytes += size
+        self._unsized.clear()
+        return self._bytes
 
 
 class FilePersistenceLayer(StatePersistenceLayer):
     """File-based persistence (survives process restart)"""
     
+    # Backups retained per session (one is taken every 10 versions)
+    BACKUPS_TO_KEEP = 5
+    
     def __init__(self, base_path: str = "./state_storage"):
         self._base_path = Path(base_path)
         self._base_path.mkdir(parents=True, exist_ok=True)
         self._ensure_backup_dir()
+        # Per-session locks: writes to different sessions run in parallel,
+        # writes to the same session never interleave
+        self._lock = _KeyLocks()
+        # Hashed keys with a state file, so misses skip the filesystem.
+        # Assumes this process is the only writer to base_path.
+        self._known_keys: Set[str] = {
+            path.stem for path in self._base_path.glob("*.json")
+        }
+        # History log contents per hashed key; missing means the log must
+        # be rewritten in full before appending again
+        self._history_marks: Dict[str, _HistoryMark] = {}
     
     def _ensure_backup_dir(self):
         """Create backup directory"""
@@ -164,53 +570,73 @@ class FilePersistenceLayer(StatePersistenceLayer):
     def _get_file_path(self, key: str) -> Path:
         """Get file path for a key"""
         # Use hash to avoid filesystem issues with special characters
-        safe_key = hashlib.md5(key.encode()).hexdigest()
-        return self._base_path / f"{safe_key}.json"
+        return self._base_path / f"{_safe_key(key)}.json"
     
     async def save(self, key: str, state: SessionState) -> bool:
         try:
+            safe_key = _safe_key(key)
             file_path = self._get_file_path(key)
+            record = _compress(state.to_record())
+            lines = _encode_history(state.conversation_history)
             
-            # Write to temp file first, then rename (atomic operation)
-            temp_path = file_path.with_suffix('.tmp')
-            
-            async with aiofiles.open(temp_path, 'w') as f:
-                await f.write(json.dumps(state.to_dict(), indent=2))
-            
-            # Atomic rename
-            temp_path.replace(file_path)
-            
-            # Create backup periodically
-            await self._create_backup_if_needed(key, state)
+            async with self._lock(key):
+                # Only entries appended since the last save are written. A
+                # trimmed or edited history gets a full rewrite, as does any
+                # save after a failed one (the mark stays popped).
+                start, mark = _history_delta(lines, self._history_marks.pop(safe_key, None))
+                data = b"".join(line + b"\n" for line in lines[start or 0:])
+                
+                # Log append + record write/rename in a single worker-thread hop
+                await asyncio.to_thread(
+                    _write_state_files, file_path, record, data, start is not None
+                )
+                self._history_marks[safe_key] = mark
+                self._known_keys.add(safe_key)
+                
+                # Create backup periodically
+                await self._create_backup_if_needed(key, state)
             
             return True
         except Exception as e:
             logger.error(f"Failed to save state to file: {e}")
             return False
     
+    def _set_history_mark(self, safe_key: str, mark: Optional[_HistoryMark]):
+        """Record what the history log holds (None forces a rewrite)"""
+        if mark is None:
+            self._history_marks.pop(safe_key, None)
+        else:
+            self._history_marks[safe_key] = mark
+    
     async def _create_backup_if_needed(self, key: str, state: SessionState):
-        """Create backup copy periodically"""
+        """Create backup copy periodically (caller holds the key's lock)"""
         # Create backup every 10 versions
         if state.version % 10 == 0:
             backup_dir = self._base_path / "backups"
-            safe_key = hashlib.md5(key.encode()).hexdigest()
+            safe_key = _safe_key(key)
             backup_path = backup_dir / f"{safe_key}_v{state.version}.json"
             
             file_path = self._get_file_path(key)
-            if file_path.exists():
-                shutil.copy(file_path, backup_path)
+            await asyncio.to_thread(
+                _take_backup, file_path, backup_path, safe_key, self.BACKUPS_TO_KEEP
+            )
     
     async def load(self, key: str) -> Optional[SessionState]:
+        if _safe_key(key) not in self._known_keys:
+            return None
+        
         try:
             file_path = self._get_file_path(key)
             
-            if not file_path.exists():
-                return None
-            
-            async with aiofiles.open(file_path, 'r') as f:
-                content = await f.read()
-                data = json.loads(content)
-                return SessionState.from_dict(data)
+            # Under the lock, so a racing save can't leave a stale mark behind
+            async with self._lock(key):
+                loaded = await asyncio.to_thread(_load_state_files, file_path)
+                if loaded is None:
+                    return None
+                
+                state, mark = loaded
+                self._set_history_mark(_safe_key(key), mark)
+            return state
         except Exception as e:
             logger.error(f"Failed to load state from file: {e}")
             # Try to load from backup
@@ -220,22 +646,20 @@ class FilePersistenceLayer(StatePersistenceLayer):
         """Attempt to load from backup files"""
         try:
             backup_dir = self._base_path / "backups"
-            safe_key = hashlib.md5(key.encode()).hexdigest()
+            safe_key = _safe_key(key)
             
             # Find most recent backup
-            backups = sorted(
-                backup_dir.glob(f"{safe_key}_v*.json"),
-                key=lambda p: p.stat().st_mtime,
-                reverse=True
-            )
+            backups = await asyncio.to_thread(_backups_newest_first, backup_dir, safe_key)
             
             for backup in backups[:3]:  # Try 3 most recent
                 try:
-                    async with aiofiles.open(backup, 'r') as f:
-                        content = await f.read()
-                        data = json.loads(content)
-                        logger.info(f"Recovered state from backup: {backup}")
-                        return SessionState.from_dict(data)
+                    # Backups hold the record only; history comes from the live log
+                    state, _ = await asyncio.to_thread(
+                        _load_state_files, self._get_file_path(key), backup
+                    )
+                    self._history_marks.pop(safe_key, None)
+                    logger.info(f"Recovered state from backup: {backup}")
+                    return state
                 except:
                     continue
         except Exception as e:
@@ -246,29 +670,46 @@ class FilePersistenceLayer(StatePersistenceLayer):
     async def delete(self, key: str) -> bool:
         try:
             file_path = self._get_file_path(key)
-            if file_path.exists():
-                file_path.unlink()
+            async with self._lock(key):
+                self._known_keys.discard(_safe_key(key))
+                self._history_marks.pop(_safe_key(key), None)
+                await asyncio.to_thread(_unlink_state_files, file_path)
             return True
         except Exception as e:
             logger.error(f"Failed to delete state file: {e}")
             return False
     
     async def exists(self, key: str) -> bool:
+        if _safe_key(key) not in self._known_keys:
+            return False
         return self._get_file_path(key).exists()
     
     async def get_all_keys(self) -> List[str]:
         """Get all keys - note: this reconstructs keys from files"""
+        return await asyncio.to_thread(self._scan_keys)
+    
+    def _scan_keys(self) -> List[str]:
+        """Blocking directory scan for get_all_keys (runs in a worker thread)"""
         keys = []
         for file_path in self._base_path.glob("*.json"):
             try:
-                async with aiofiles.open(file_path, 'r') as f:
-                    content = await f.read()
-                    data = json.loads(content)
-                    keys.append(data.get("session_id", file_path.stem))
+                data = _loads(_decompress(file_path.read_bytes()))
+                keys.append(data.get("session_id", file_path.stem))
             except:
                 pass
         return keys
     
+    async def iter_all(self) -> AsyncIterator[SessionState]:
+        """Yield every stored session, reading and parsing each file once"""
+        paths = await asyncio.to_thread(lambda: list(self._base_path.glob("*.json")))
+        for file_path in paths:
+            try:
+                loaded = await asyncio.to_thread(_load_state_files, file_path)
+                if loaded is not None:
+                    yield loaded[0]
+            except Exception as e:
+                logger.warning(f"Skipping unreadable state file {file_path}: {e}")
+    
     async def cleanup_old_states(self, max_age_days: int = 30):
         """Clean up old state files"""
         cutoff = datetime.now() - timedelta(days=max_age_days)
@@ -277,49 +718,170 @@ class FilePersistenceLayer(StatePersistenceLayer):
             try:
                 mtime = datetime.fromtimestamp(file_path.stat().st_mtime)
                 if mtime < cutoff:
-                    file_path.unlink()
+                    self._known_keys.discard(file_path.stem)
+                    self._history_marks.pop(file_path.stem, None)
+                    _unlink_state_files(file_path)
                     logger.info(f"Cleaned up old state file: {file_path}")
             except Exception as e:
                 logger.error(f"Failed to cleanup {file_path}: {e}")
 
 
+# Redis list holding a session's conversation history ("<key>:history")
+_REDIS_HISTORY_SUFFIX = ":history"
+
+
 class RedisPersistenceLayer(StatePersistenceLayer):
     """Redis-based persistence (distributed, fast)"""
     
-    def __init__(self, redis_url: str = "redis://localhost:6379", ttl: int = 86400):
+    def __init__(
+        self,
+        redis_url: str = "redis://localhost:6379",
+        ttl: int = 86400,
+        max_connections: int = 32
+    ):
         self._redis_url = redis_url
         self._ttl = ttl
+        self._max_connections = max_connections
+        self._pool = None
         self._redis = None
         self._connected = False
+        # History list contents per session key, as last written or read by
+        # this process (assumes one writer process per session)
+        self._history_marks: Dict[str, _HistoryMark] = {}
+        self._lock = _KeyLocks()
     
     async def _ensure_connection(self):
-        """Ensure Redis connection"""
+        """Ensure a pooled Redis client (created once, reused for every call)"""
         if not self._connected:
             try:
-                import aioredis
-                self._redis = await aioredis.from_url(self._redis_url)
+                from redis.asyncio import Redis, ConnectionPool
+                self._pool = ConnectionPool.from_url(
+                    self._redis_url,
+                    max_connections=self._max_connections,
+                    decode_responses=False,
+                )
+                self._redis = Redis(connection_pool=self._pool)
                 self._connected = True
             except Exception as e:
                 logger.error(f"Failed to connect to Redis: {e}")
                 raise
     
+    async def close(self):
+        """Release all pooled connections"""
+        if self._pool is not None:
+            await self._pool.disconnect()
+        self._pool = None
+        self._redis = None
+        self._connected = False
+    
+    def _queue_save(
+        self,
+        pipe,
+        key: str,
+        state: SessionState
+    ) -> Tuple[_HistoryMark, Optional[int]]:
+        """
+        Queue the commands saving one state: RPUSH of the history entries
+        appended since the last save (or a full rewrite of the list when it
+        was trimmed or edited), then the main record. Caller holds the
+        key's lock.
+        
+        Returns the new mark and, for an append, the index of the reply that
+        holds the list's length afterwards. The list may have expired or been
+        deleted since the mark was taken; then that length is short and the
+        caller must rewrite the list (see _rewrite_histories).
+        """
+        lines = _encode_history(state.conversation_history)
+        history_key = key + _REDIS_HISTORY_SUFFIX
+        start, mark = _history_delta(lines, self._history_marks.pop(key, None))
+        check_at = None
+        if start is None:
+            pipe.delete(history_key)
+            if lines:
+                pipe.rpush(history_key, *lines)
+        elif lines:
+            check_at = len(pipe)
+            if len(lines) > start:
+                pipe.rpush(history_key, *lines[start:])
+            else:
+                pipe.llen(history_key)
+        pipe.expire(history_key, self._ttl)
+        pipe.setex(key, self._ttl, _compress(state.to_record()))
+        return mark, check_at
+    
+    async def _rewrite_histories(self, items: Dict[str, SessionState]):
+        """Replace the history lists of states whose append found the list gone"""
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for key, state in items.items():
+                history_key = key + _REDIS_HISTORY_SUFFIX
+                pipe.delete(history_key)
+                pipe.rpush(history_key, *_encode_history(state.conversation_history))
+                pipe.expire(history_key, self._ttl)
+            await pipe.execute()
+    
     async def save(self, key: str, state: SessionState) -> bool:
         try:
             await self._ensure_connection()
-            data = json.dumps(state.to_dict())
-            await self._redis.setex(key, self._ttl, data)
+            async with self._lock(key):
+                async with self._redis.pipeline(transaction=True) as pipe:
+                    mark, check_at = self._queue_save(pipe, key, state)
+                    replies = await pipe.execute()
+                if check_at is not None and replies[check_at] != mark[0]:
+                    await self._rewrite_histories({key: state})
+                self._history_marks[key] = mark
             return True
         except Exception as e:
             logger.error(f"Failed to save to Redis: {e}")
             return False
     
+    async def save_many(self, items: Dict[str, SessionState]) -> bool:
+        """Save several states in one pipelined round trip"""
+        if not items:
+            return True
+        try:
+            await self._ensure_connection()
+            async with AsyncExitStack() as stack:
+                # Sorted, so overlapping batches take their locks in one order
+                for key in sorted(items):
+                    await stack.enter_async_context(self._lock(key))
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    queued = {
+                        key: self._queue_save(pipe, key, state)
+                        for key, state in items.items()
+                    }
+                    replies = await pipe.execute()
+                stale = {
+                    key: items[key]
+                    for key, (mark, check_at) in queued.items()
+                    if check_at is not None and replies[check_at] != mark[0]
+                }
+                if stale:
+                    await self._rewrite_histories(stale)
+                self._history_marks.update(
+                    (key, mark) for key, (mark, _) in queued.items()
+                )
+            return True
+        except Exception as e:
+            logger.error(f"Failed to batch save to Redis: {e}")
+            return False
+    
     async def load(self, key: str) -> Optional[SessionState]:
         try:
             await self._ensure_connection()
-            data = await self._redis.get(key)
-            if data:
-                return SessionState.from_dict(json.loads(data))
-            return None
+            async with self._lock(key):
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.get(key)
+                    pipe.lrange(key + _REDIS_HISTORY_SUFFIX, 0, -1)
+                    data, history = await pipe.execute()
+                if not data:
+                    return None
+                
+                state, mark = _state_from_record(data, history)
+                if mark is None:
+                    self._history_marks.pop(key, None)
+                else:
+                    self._history_marks[key] = mark
+            return state
         except Exception as e:
             logger.error(f"Failed to load from Redis: {e}")
             return None
@@ -327,7 +889,9 @@ class RedisPersistenceLayer(StatePersistenceLayer):
     async def delete(self, key: str) -> bool:
         try:
             await self._ensure_connection()
-            await self._redis.delete(key)
+            async with self._lock(key):
+                self._history_marks.pop(key, None)
+                await self._redis.delete(key, key + _REDIS_HISTORY_SUFFIX)
             return True
         except Exception as e:
             logger.error(f"Failed to delete from Redis: {e}")
@@ -343,8 +907,12 @@ class RedisPersistenceLayer(StatePersistenceLayer):
     async def get_all_keys(self) -> List[str]:
         try:
             await self._ensure_connection()
-            keys = await self._redis.keys("*")
-            return [k.decode() if isinstance(k, bytes) else k for k in keys]
+            # SCAN iterates incrementally instead of blocking Redis like KEYS
+            keys = [
+                k.decode() if isinstance(k, bytes) else k
+                async for k in self._redis.scan_iter(match="*", count=500)
+            ]
+            return [k for k in keys if not k.endswith(_REDIS_HISTORY_SUFFIX)]
         except:
             return []
 
@@ -353,13 +921,30 @@ class MultiLayerStateManager:
     """
     Multi-layer state persistence manager
     Tries layers in order: Memory -> File -> Redis
+    
+    With write-back enabled (default), save_state only writes the memory
+    layer inline; slower layers are updated by a background flush task that
+    coalesces repeated saves of the same session. Call close() on shutdown.
     """
     
-    def __init__(self):
+    def __init__(self, writeback_enabled: bool = True):
         self._layers: List[StatePersistenceLayer] = []
         self._write_layers: List[StatePersistenceLayer] = []
         self._sync_interval = 60  # Seconds between syncs
         self._last_sync: Dict[str, datetime] = {}
+        # Digest of the newest content written or queued for every layer,
+        # per key; taken before any write, so later in-place edits of the
+        # state object never count as persisted
+        self._content_hash: Dict[str, bytes] = {}
+        
+        # Write-back state: sessions waiting to be synced to slower layers,
+        # with the digest taken when they were saved
+        self._writeback_enabled = writeback_enabled
+        self._dirty: Dict[str, Tuple[SessionState, bytes]] = {}
+        self._flush_event = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        # Set by close(): the flush loop finishes its current write and exits
+        self._closing = False
     
     def add_layer(self, layer: StatePersistenceLayer, write: bool = True):
         """Add a persistence layer"""
@@ -371,12 +956,24 @@ class MultiLayerStateManager:
         """
         Save state to all write layers
         
+        Saves whose content matches the newest saved content (written or
+        still queued) only refresh the memory layer: no version bump and no
+        IO on the slower layers.
+        
         Args:
             state: The session state to save
-            sync_all: If True, write to all layers; if False, only write to fastest layer
+            sync_all: If True, write to all layers before returning; if False,
+                only write to fastest layer and sync the rest later
         """
         key = state.session_id
-        state.update_timestamp()
+        
+        digest = self._content_digest(state)
+        unchanged = self._content_hash.get(key) == digest
+        
+        # One clock read per save, shared by the timestamp and sync bookkeeping
+        now = datetime.now()
+        if not unchanged:
+            state.update_timestamp(now)
         
         success = False
         
@@ -387,45 +984,204 @@ class MultiLayerStateManager:
             except Exception as e:
                 logger.error(f"Failed to save to primary layer: {e}")
         
+        if unchanged:
+            # Same content already written or queued for the slower layers
+            return success
+        
+        if self._writeback_enabled and not sync_all and not self._closing:
+            # Defer slower layers to the background flush task
+            self._dirty[key] = (state, digest)
+            self._content_hash[key] = digest
+            self._ensure_flush_task()
+            if self._should_sync(key, now):
+                self._flush_event.set()
+            return success
+        
         # Sync to other layers periodically or if requested
-        should_sync = sync_all or self._should_sync(key)
+        should_sync = sync_all or self._should_sync(key, now)
         
-        if should_sync:
-            for layer in self._write_layers[1:]:
-                try:
-                    await layer.save(key, state)
-                except Exception as e:
-                    logger.warning(f"Failed to sync to layer: {e}")
-            
-            self._last_sync[key] = datetime.now()
+        if should_sync and success:
+            await self._sync_to_layers(key, state, now, digest)
         
         return success
     
-    def _should_sync(self, key: str) -> bool:
+    async def _sync_to_layers(
+        self,
+        key: str,
+        state: SessionState,
+        now: datetime,
+        digest: bytes
+    ) -> bool:
+        """Write a state to every layer after the primary one"""
+        self._content_hash[key] = digest
+        synced = True
+        for layer in self._write_layers[1:]:
+            try:
+                if not await layer.save(key, state):
+                    synced = False
+            except Exception as e:
+                synced = False
+                logger.warning(f"Failed to sync to layer: {e}")
+        
+        self._last_sync[key] = now
+        if not synced and self._content_hash.get(key) == digest:
+            # Let the next save of this content try again
+            del self._content_hash[key]
+        return synced
+    
+    def _ensure_flush_task(self):
+        """Start the write-back task on first use (needs a running loop)"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def _flush_loop(self):
+        """Background task: flush dirty sessions when due, or every sync interval"""
+        while not self._closing:
+            # asyncio.timeout rather than wait_for: on 3.11 wait_for wraps the
+            # wait in a task, and cancelling the loop during asyncio.run's
+            # shutdown could then hang waiting for that task
+            try:
+                async with asyncio.timeout(self._sync_interval):
+                    await self._flush_event.wait()
+            except TimeoutError:
+                pass
+            self._flush_event.clear()
+            
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Write-back flush failed: {e}")
+    
+    async def flush(self):
+        """Write all pending write-back sessions to the slower layers"""
+        if not self._dirty:
+            return
+        
+        batch, self._dirty = self._dirty, {}
+        try:
+            synced = await self._sync_batch_to_layers(batch)
+        except asyncio.CancelledError:
+            # Keep the batch so close() can still write it
+            for key, entry in batch.items():
+                self._dirty.setdefault(key, entry)
+            raise
+        
+        # Failed syncs stay dirty and are retried on the next flush
+        if not synced:
+            for key, entry in batch.items():
+                self._dirty.setdefault(key, entry)
+    
+    async def _sync_batch_to_layers(self, batch: Dict[str, Tuple[SessionState, bytes]]) -> bool:
+        """Write a batch of states to every layer after the primary one"""
+        states = {key: state for key, (state, _) in batch.items()}
+        synced = True
+        for layer in self._write_layers[1:]:
+            try:
+                if not await layer.save_many(states):
+                    synced = False
+            except Exception as e:
+                synced = False
+                logger.warning(f"Failed to sync batch to layer: {e}")
+        
+        now = datetime.now()
+        for key in batch:
+            self._last_sync[key] = now
+        return synced
+    
+    async def close(self):
+        """Stop the write-back task, flush everything pending and close layers"""
+        # Wake the flush loop rather than cancelling it: cancelling can
+        # abandon a write still running in a worker thread
+        self._closing = True
+        self._flush_event.set()
+        if self._flush_task:
+            await self._flush_task
+            self._flush_task = None
+        
+        await self.flush()
+        
+        for layer in self._layers:
+            try:
+                await layer.close()
+            except Exception as e:
+                logger.warning(f"Failed to close layer: {e}")
+    
+    @staticmethod
+    def _content_digest(state: SessionState) -> bytes:
+        """Hash of the state's content, ignoring save bookkeeping fields"""
+        payload = _dumps(state.to_dict(exclude=_VOLATILE_FIELDS))
+        return hashlib.blake2b(payload, digest_size=16).digest()
+    
+    def _should_sync(self, key: str, now: datetime) -> bool:
         """Determine if we should sync to persistent layers"""
-        if key not in self._last_sync:
+        last_sync = self._last_sync.get(key)
+        if last_sync is None:
             return True
         
-        elapsed = (datetime.now() - self._last_sync[key]).total_seconds()
+        elapsed = (now - last_sync).total_seconds()
         return elapsed >= self._sync_interval
     
     async def load_state(self, session_id: str) -> Optional[SessionState]:
         """
         Load state from first available layer
-        Tries layers in order until one succeeds
+        The primary (memory) layer is tried first; on a miss the slower
+        layers are queried concurrently and the first hit wins
         """
-        for layer in self._layers:
-            try:
-                state = await layer.load(session_id)
-                if state:
-                    logger.debug(f"Loaded state from {layer.__class__.__name__}")
-                    return state
-            except Exception as e:
-                logger.warning(f"Failed to load from layer: {e}")
-                continue
+        # A session waiting for write-back is newer than anything on disk
+        entry = self._dirty.get(session_id)
+        if entry:
+            return entry[0]
+        
+        if not self._layers:
+            return None
+        
+        state = await self._load_from_layer(self._layers[0], session_id)
+        if state:
+            return state
+        
+        tasks = {
+            asyncio.create_task(self._load_from_layer(layer, session_id))
+            for layer in self._layers[1:]
+        }
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    state = task.result()
+                    if state:
+                        await self._warm_primary(session_id, state)
+                        return state
+        finally:
+            for task in tasks:
+                task.cancel()
         
         return None
     
+    async def _load_from_layer(
+        self,
+        layer: StatePersistenceLayer,
+        session_id: str
+    ) -> Optional[SessionState]:
+        """Load from a single layer, treating errors as a miss"""
+        try:
+            state = await layer.load(session_id)
+            if state:
+                logger.debug(f"Loaded state from {layer.__class__.__name__}")
+            return state
+        except Exception as e:
+            logger.warning(f"Failed to load from layer: {e}")
+            return None
+    
+    async def _warm_primary(self, session_id: str, state: SessionState):
+        """Populate the fast layer after a hit in a slower one"""
+        primary = self._layers[0]
+        if primary not in self._write_layers:
+            return
+        try:
+            await primary.save(session_id, state)
+        except Exception as e:
+            logger.warning(f"Failed to warm primary layer: {e}")
+    
     async def delete_state(self, session_id: str) -> bool:
         """Delete state from all layers"""
         success = True
@@ -438,6 +1194,8 @@ class MultiLayerStateManager:
         
         if session_id in self._last_sync:
             del self._last_sync[session_id]
+        self._content_hash.pop(session_id, None)
+        self._dirty.pop(session_id, None)
         
         return success
     
@@ -457,13 +1215,10 @@ class MultiLayerStateManager:
         # Use first layer that supports listing
         for layer in self._layers:
             try:
-                keys = await layer.get_all_keys()
-                for key in keys:
-                    state = await layer.load(key)
-                    if state:
-                        sessions.append(state)
+                sessions = [state async for state in layer.iter_all()]
                 break
             except:
+                sessions = []
                 continue
         
         return sessions
@@ -475,11 +1230,12 @@ def create_state_manager(
     use_file: bool = True,
     file_path: str = "./state_storage",
     use_redis: bool = False,
-    redis_url: str = "redis://localhost:6379"
+    redis_url: str = "redis://localhost:6379",
+    writeback_enabled: bool = True
 ) -> MultiLayerStateManager:
     """Create a configured state manager"""
     
-    manager = MultiLayerStateManager()
+    manager = MultiLayerStateManager(writeback_enabled=writeback_enabled)
     
     if use_memory:
         manager.add_layer(MemoryPersistenceLayer(), write=True)
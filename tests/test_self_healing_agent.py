@@ -0,0 +1,322 @@
+"""
+Self-Healing Agent - Tests
+Covers request handling, recovery paths, background state saves and
+health reporting.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dead_letter_queue import DeadLetterQueue, DLQItemStatus
+import self_healing_agent
+from self_healing_agent import (
+    RetryScheduler, SelfHealingInvoiceAgent, _DEFAULT_TEXT, _GREET_TEXT, _HELP_TEXT, _REQ,
+    _warn_throttled, idempotent
+)
+from state_persistence import FilePersistenceLayer
+
+
+def run(coro, timeout: float = 5.0):
+    """Run a coroutine, failing instead of hanging past the timeout"""
+    return asyncio.run(asyncio.wait_for(coro, timeout))
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    # The agent keeps its state and DLQ storage relative to the working dir
+    monkeypatch.chdir(tmp_path)
+    agent = SelfHealingInvoiceAgent()
+    yield agent
+
+
+async def stop(agent: SelfHealingInvoiceAgent):
+    await agent.shutdown()
+    if agent.dlq:
+        await agent.dlq.stop_processor()
+
+
+def test_process_message_accepts_int_ids(agent):
+    async def scenario():
+        response = await agent.process_message(42, 7, "hello")
+        assert response.success
+        assert not response.used_fallback
+        assert _REQ.get(None) is None
+        
+        state = await agent._get_session_state(("42", "7"))
+        assert (state.session_id, state.user_id, state.chat_id) == ("42:7", "42", "7")
+        assert len(state.conversation_history) == 1
+        await stop(agent)
+
+    run(scenario())
+
+
+def test_session_state_survives_between_messages(agent):
+    async def scenario():
+        await agent.process_message("1", "2", "hello")
+        await agent.process_message("1", "2", "again")
+        state = await agent.state_manager.load_state("1:2")
+        assert [e["content"] for e in state.conversation_history] == ["hello", "again"]
+        await stop(agent)
+
+    run(scenario())
+
+
+def test_reply_does_not_wait_for_slow_state_layers(agent, monkeypatch):
+    release = asyncio.Event()
+    original_save_many = FilePersistenceLayer.save_many
+
+    async def slow_save_many(self, items):
+        await release.wait()
+        return await original_save_many(self, items)
+
+    monkeypatch.setattr(FilePersistenceLayer, "save_many", slow_save_many)
+
+    async def scenario():
+        response = await agent.process_message("1", "2", "hello", deadline_seconds=1.0)
+        assert not response.used_fallback
+        
+        release.set()
+        await stop(agent)  # Flushes the pending write-back
+        stored = await FilePersistenceLayer("./state_storage").load("1:2")
+        assert len(stored.conversation_history) == 1
+
+    run(scenario())
+
+
+def test_saves_persisted_when_later_init_step_fails(agent, monkeypatch):
+    async def broken_initialize(self):
+        raise RuntimeError("dlq storage unavailable")
+
+    monkeypatch.setattr(DeadLetterQueue, "initialize", broken_initialize)
+
+    async def scenario():
+        await agent.process_message("1", "2", "hello")
+        await asyncio.sleep(0.05)  # A session's first save is flushed at once
+        
+        stored = await FilePersistenceLayer("./state_storage").load("1:2")
+        assert len(stored.conversation_history) == 1
+        await stop(agent)
+
+    run(scenario())
+
+
+def test_concurrent_first_messages_initialize_once(agent, monkeypatch):
+    calls = 0
+    original_initialize = DeadLetterQueue.initialize
+
+    async def slow_initialize(self):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)  # Let the other messages arrive mid-init
+        return await original_initialize(self)
+
+    monkeypatch.setattr(DeadLetterQueue, "initialize", slow_initialize)
+
+    async def scenario():
+        responses = await asyncio.gather(
+            *(agent.process_message(str(n), "2", "hello") for n in range(5))
+        )
+        assert all(r.success and not r.used_fallback for r in responses)
+        assert calls == 1
+        await stop(agent)
+
+    run(scenario())
+
+
+STATIC_REPLIES = {"help": _HELP_TEXT, "greet": _GREET_TEXT, "default": _DEFAULT_TEXT}
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("help", "help"),
+    ("Can you HELP me", "help"),
+    ("how do I upload", "help"),
+    ("how's this work", "help"),
+    ("what now?", "help"),
+    ("hello, how are you", "help"),   # Help wins over a greeting
+    ("hi", "greet"),
+    ("Hey there!", "greet"),
+    ("this invoice", "default"),      # Keywords match whole words only
+    ("show my invoices", "default"),
+    ("howdy", "default"),
+    ("very helpful", "default"),
+    ("", "default"),
+])
+def test_static_text_response_intents(agent, message, intent):
+    assert agent._get_static_text_response(message) == STATIC_REPLIES[intent]
+
+
+def test_health_status_returns_copies(agent):
+    async def scenario():
+        await agent.initialize()
+        first = await agent.get_health_status()
+        first["service_health"]["ai_models"] = "down"
+        first["agent_initialized"] = "tampered"
+        first["circuit_breakers"].pop("database")
+        first["circuit_breakers"]["ai_model"]["state"] = "tampered"
+        first["circuit_breakers"]["ai_model"]["stats"].clear()
+
+        second = await agent.get_health_status()
+        assert second["service_health"]["ai_models"] == "healthy"
+        assert second["agent_initialized"] is True
+        assert "database" in second["circuit_breakers"]
+        assert second["circuit_breakers"]["ai_model"]["state"] != "tampered"
+        assert second["circuit_breakers"]["ai_model"]["stats"]
+        assert 0 <= second["cache_age"] < agent.HEALTH_CACHE_TTL
+        await stop(agent)
+
+    run(scenario())
+
+
+def test_warn_throttled_keys_on_error_type(caplog, monkeypatch):
+    monkeypatch.setattr(self_healing_agent, "_last_warned", {})
+    with caplog.at_level(logging.WARNING, logger=self_healing_agent.__name__):
+        _warn_throttled("primary_failed", "Primary execution failed: %s", TimeoutError("a"))
+        _warn_throttled("primary_failed", "Primary execution failed: %s", TimeoutError("b"))
+        _warn_throttled("primary_failed", "Primary execution failed: %s", KeyError("c"))
+
+    assert [r.getMessage() for r in caplog.records] == [
+        "Primary execution failed: a",
+        "Primary execution failed: 'c'",
+    ]
+
+
+def test_warn_throttled_reports_suppressed_count(caplog, monkeypatch):
+    monkeypatch.setattr(self_healing_agent, "_last_warned", {})
+    monkeypatch.setattr(self_healing_agent, "_WARN_INTERVAL", 0.05)
+    with caplog.at_level(logging.WARNING, logger=self_healing_agent.__name__):
+        for n in range(3):
+            _warn_throttled("degraded_failed", "Degraded mode failed: %s", ValueError(n))
+        time.sleep(0.06)
+        _warn_throttled("degraded_failed", "Degraded mode failed: %s", ValueError(3))
+
+    assert [r.getMessage() for r in caplog.records] == [
+        "Degraded mode failed: 0",
+        "Degraded mode failed: 3 (2 similar warnings suppressed)",
+    ]
+
+def test_retry_scheduler_coalesces_wakeups():
+    async def scenario():
+        scheduler = RetryScheduler(resolution=0.05)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        sleeps = [scheduler.sleep_for(0.05 + n * 0.001) for n in range(5)]
+        tasks = [asyncio.ensure_future(sleep) for sleep in sleeps]
+        await asyncio.sleep(0)
+        assert 1 <= len(scheduler._buckets) <= 2
+        
+        await asyncio.gather(*tasks)
+        assert loop.time() - start >= 0.05
+        assert not scheduler._buckets
+
+    run(scenario())
+
+
+def test_retry_scheduler_survives_cancelled_waiter():
+    async def scenario():
+        scheduler = RetryScheduler(resolution=0.05)
+        cancelled = asyncio.ensure_future(scheduler.sleep_for(0.05))
+        waiting = asyncio.ensure_future(scheduler.sleep_for(0.05))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await waiting
+        assert cancelled.cancelled()
+
+    run(scenario())
+
+@pytest.mark.parametrize("flag, expected_attempts", [
+    (True, SelfHealingInvoiceAgent.MAX_RETRIES + 1),
+    (False, 1),   # Non-idempotent operations are never retried
+])
+def test_only_idempotent_operations_are_retried(agent, flag, expected_attempts):
+    async def scenario():
+        attempts = 0
+
+        @idempotent(flag)
+        async def always_fails():
+            nonlocal attempts
+            attempts += 1
+            raise ConnectionError("service down")
+
+        agent.BASE_DELAY = 0.01
+        with pytest.raises(ConnectionError):
+            await agent._execute_with_retry(always_fails)
+        assert attempts == expected_attempts
+
+    run(scenario())
+
+
+def test_failed_upload_is_attempted_once(agent):
+    async def scenario():
+        downloads = 0
+
+        async def download_unavailable(attachment):
+            nonlocal downloads
+            downloads += 1
+            raise ConnectionError("telegram file api down")
+
+        agent._download_file = download_unavailable
+        response = await agent.process_message("1", "2", "", attachments=[{"file_id": "abc"}])
+        assert response.used_fallback
+        assert downloads == 1
+        await asyncio.gather(*agent._background_tasks)
+        await stop(agent)
+
+    run(scenario())
+
+
+def test_retries_stop_at_the_request_deadline(agent):
+    async def scenario():
+        attempts = 0
+
+        async def always_fails():
+            nonlocal attempts
+            attempts += 1
+            raise ConnectionError("service down")
+
+        agent._handle_text_message = always_fails
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        response = await agent.process_message("1", "2", "hello", deadline_seconds=0.5)
+        
+        assert response.text
+        assert loop.time() - start < 1.0
+        assert attempts >= 1
+        await stop(agent)
+
+    run(scenario())
+
+
+def test_unrecoverable_failure_reaches_the_dlq_and_is_replayed(agent):
+    async def scenario():
+        async def download_unavailable(attachment):
+            raise ConnectionError("telegram file api down")
+
+        agent._download_file = download_unavailable
+        attachment = {"file_id": "abc"}
+        response = await agent.process_message("1", "2", "", attachments=[attachment])
+        assert response.used_fallback
+        await asyncio.gather(*agent._background_tasks)
+        
+        [item] = agent.dlq.get_all_items(operation_type="_handle_document_upload")
+        assert item.status == DLQItemStatus.PENDING
+        assert item.payload["user_id"] == "1"
+        assert item.payload["attachments"] == [attachment]
+        assert "ConnectionError" in item.payload["error"]
+        
+        # Once the service is back the DLQ processor replays the upload
+        del agent._download_file
+        await agent.dlq._process_ready_items()
+        assert item.status == DLQItemStatus.SUCCESS
+        state = await agent.state_manager.load_state("1:2")
+        assert state.current_step == "awaiting_confirmation"
+        await stop(agent)
+
+    run(scenario())
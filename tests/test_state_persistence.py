@@ -0,0 +1,640 @@
+"""
+State Persistence - Tests
+Covers write-back flushing, dirty tracking, incremental history logs,
+backups and the in-memory segmented LRU.
+"""
+
+import asyncio
+import copy
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state_persistence import (
+    SessionState, FilePersistenceLayer, MemoryPersistenceLayer, MultiLayerStateManager,
+    RedisPersistenceLayer, ZSTD_AVAILABLE, create_state_manager
+)
+
+
+def run(coro, timeout: float = 5.0):
+    """Run a coroutine, failing instead of hanging past the timeout"""
+    return asyncio.run(asyncio.wait_for(coro, timeout))
+
+
+def make_state(session_id: str = "user:1", history=None) -> SessionState:
+    user_id, chat_id = session_id.split(":")
+    return SessionState(
+        session_id=session_id,
+        user_id=user_id,
+        chat_id=chat_id,
+        conversation_history=list(history or []),
+    )
+
+
+# ---------------------------------------------------------------------------
+# Write-back flush and close
+# ---------------------------------------------------------------------------
+
+def test_close_after_save_does_not_hang(tmp_path):
+    async def scenario():
+        manager = create_state_manager(file_path=str(tmp_path))
+        state = make_state()
+        state.current_step = "awaiting_upload"
+        await manager.save_state(state)
+        await asyncio.sleep(0)
+        await manager.close()
+
+        reloaded = await FilePersistenceLayer(str(tmp_path)).load("user:1")
+        assert reloaded is not None
+        assert reloaded.current_step == "awaiting_upload"
+
+    run(scenario())
+
+
+def test_close_without_flush_task(tmp_path):
+    async def scenario():
+        manager = create_state_manager(file_path=str(tmp_path))
+        await manager.close()
+
+    run(scenario())
+
+
+def test_save_after_close_is_written_inline(tmp_path):
+    async def scenario():
+        manager = create_state_manager(file_path=str(tmp_path))
+        await manager.close()
+        await manager.save_state(make_state())
+
+        assert await FilePersistenceLayer(str(tmp_path)).load("user:1") is not None
+
+    run(scenario())
+
+
+def test_unclosed_manager_does_not_hang_interpreter_shutdown(tmp_path):
+    # Runs in a subprocess: a regression would hang asyncio.run, not fail
+    script = f"""
+import asyncio, sys
+sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})
+from state_persistence import SessionState, create_state_manager
+
+async def main():
+    manager = create_state_manager(file_path={str(tmp_path)!r})
+    await manager.save_state(SessionState(session_id="user:1", user_id="user", chat_id="1"))
+    # Fail without close(), before the flush loop has run
+    raise RuntimeError("handler failed")
+
+asyncio.run(asyncio.wait_for(main(), 5))
+"""
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, timeout=10)
+    assert b"RuntimeError: handler failed" in result.stderr
+
+
+def test_writeback_defers_slower_layers_until_flush(tmp_path):
+    async def scenario():
+        manager = MultiLayerStateManager()
+        manager.add_layer(MemoryPersistenceLayer())
+        manager.add_layer(FilePersistenceLayer(str(tmp_path)))
+        state = make_state()
+        
+        # First save of a session is due for a sync right away
+        await manager.save_state(state)
+        await asyncio.sleep(0.05)
+        stored = await FilePersistenceLayer(str(tmp_path)).load("user:1")
+        assert stored.current_step == "start"
+        
+        # Later saves within the sync interval stay in memory until flushed
+        state.current_step = "awaiting_upload"
+        await manager.save_state(state)
+        await asyncio.sleep(0.05)
+        stored = await FilePersistenceLayer(str(tmp_path)).load("user:1")
+        assert stored.current_step == "start"
+        
+        await manager.flush()
+        stored = await FilePersistenceLayer(str(tmp_path)).load("user:1")
+        assert stored.current_step == "awaiting_upload"
+        await manager.close()
+
+    run(scenario())
+
+
+# ---------------------------------------------------------------------------
+# Dirty tracking
+# ---------------------------------------------------------------------------
+
+def make_manager(tmp_path, file_layer=None):
+    manager = MultiLayerStateManager()
+    manager.add_layer(MemoryPersistenceLayer())
+    manager.add_layer(file_layer or FilePersistenceLayer(str(tmp_path)))
+    return manager
+
+
+def test_reverted_edit_is_saved(tmp_path):
+    async def scenario():
+        manager = make_manager(tmp_path)
+        original = make_state()
+        await manager.save_state(original)
+        await manager.flush()
+        
+        edited = copy.deepcopy(original)
+        edited.current_step = "x"
+        await manager.save_state(edited)
+        await manager.save_state(copy.deepcopy(original))  # Back to "start"
+        await manager.flush()
+        
+        assert (await manager.load_state("user:1")).current_step == "start"
+        stored = await FilePersistenceLayer(str(tmp_path)).load("user:1")
+        assert stored.current_step == "start"
+        await manager.close()
+
+    run(scenario())
+
+
+def test_edit_during_flush_is_not_recorded_as_persisted(tmp_path):
+    flushing = asyncio.Event()
+    release = asyncio.Event()
+
+    class SlowFileLayer(FilePersistenceLayer):
+        async def save_many(self, items):
+            result = await super().save_many(items)
+            flushing.set()
+            await release.wait()
+            return result
+
+    async def scenario():
+        manager = make_manager(tmp_path, SlowFileLayer(str(tmp_path)))
+        state = make_state(history=[{"n": 0}])
+        await manager.save_state(state)
+        
+        # The first save is due at once, so the flush loop may get there first
+        flush = asyncio.create_task(manager.flush())
+        await flushing.wait()
+        # The handler edits the live object while its old content is written
+        state.conversation_history.append({"n": 1})
+        release.set()
+        await flush
+        await asyncio.sleep(0.05)
+        
+        await manager.save_state(state)
+        await manager.flush()
+        stored = await FilePersistenceLayer(str(tmp_path)).load("user:1")
+        assert history_of(stored) == [0, 1]
+        await manager.close()
+
+    run(scenario())
+
+
+def test_unchanged_save_still_refreshes_memory(tmp_path):
+    async def scenario():
+        manager = make_manager(tmp_path)
+        state = make_state()
+        await manager.save_state(state)
+        version = state.version
+        
+        memory = manager._layers[0]
+        await memory.delete("user:1")
+        await manager.save_state(state)
+        
+        assert await memory.exists("user:1")
+        assert state.version == version
+        await manager.close()
+
+    run(scenario())
+
+
+# ---------------------------------------------------------------------------
+# Layered loads
+# ---------------------------------------------------------------------------
+
+class HungLayer(MemoryPersistenceLayer):
+    """A slow layer whose loads never finish until cancelled"""
+
+    def __init__(self):
+        super().__init__()
+        self.cancelled = False
+
+    async def load(self, session_id):
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+def test_load_takes_first_slow_layer_hit_and_warms_memory(tmp_path):
+    async def scenario():
+        file_layer = FilePersistenceLayer(str(tmp_path))
+        await file_layer.save("user:1", make_state(history=[{"n": 0}]))
+        
+        memory, hung = MemoryPersistenceLayer(), HungLayer()
+        manager = MultiLayerStateManager()
+        manager.add_layer(memory)
+        manager.add_layer(hung, write=False)
+        manager.add_layer(file_layer)
+        
+        async with asyncio.timeout(1):
+            state = await manager.load_state("user:1")
+        assert history_of(state) == [0]
+        await asyncio.sleep(0)
+        assert hung.cancelled
+        assert history_of(await memory.load("user:1")) == [0]
+        await manager.close()
+
+    run(scenario())
+
+
+# ---------------------------------------------------------------------------
+# Memory layer (segmented LRU) and file backups
+# ---------------------------------------------------------------------------
+
+def test_memory_layer_keeps_reused_sessions_over_one_offs():
+    async def scenario():
+        layer = MemoryPersistenceLayer(max_size=4)
+        await layer.save("user:1", make_state("user:1"))
+        assert await layer.load("user:1") is not None  # Promoted to protected
+        
+        for n in range(2, 12):
+            key = f"user:{n}"
+            await layer.save(key, make_state(key))
+        
+        keys = await layer.get_all_keys()
+        assert len(keys) == 4
+        assert "user:1" in keys
+        assert "user:11" in keys
+        assert "user:2" not in keys
+
+    run(scenario())
+
+
+def test_memory_layer_evicts_when_everything_is_protected():
+    async def scenario():
+        layer = MemoryPersistenceLayer(max_size=2)
+        for key in ("user:1", "user:2"):
+            await layer.save(key, make_state(key))
+            await layer.load(key)
+        
+        await layer.save("user:3", make_state("user:3"))
+        assert len(await layer.get_all_keys()) == 2
+        assert await layer.exists("user:3")
+
+    run(scenario())
+
+
+def test_file_backups_are_pruned(tmp_path):
+    async def scenario():
+        layer = FilePersistenceLayer(str(tmp_path))
+        state = make_state()
+        for version in range(10, 100, 10):
+            state.version = version
+            await layer.save("user:1", state)
+        
+        versions = sorted(
+            int(path.stem.rsplit("_v", 1)[1]) for path in (tmp_path / "backups").iterdir()
+        )
+        assert versions == [50, 60, 70, 80, 90]
+
+    run(scenario())
+
+
+def test_file_layer_recovers_from_backup(tmp_path):
+    async def scenario():
+        layer = FilePersistenceLayer(str(tmp_path))
+        state = make_state()
+        state.version = 10
+        state.current_step = "awaiting_upload"
+        await layer.save("user:1", state)
+        
+        # Replace (not overwrite) the file: backups are hard links to it
+        file_path = layer._get_file_path("user:1")
+        broken = tmp_path / "broken"
+        broken.write_bytes(b"not json")
+        os.replace(broken, file_path)
+        recovered = await FilePersistenceLayer(str(tmp_path)).load("user:1")
+        assert recovered is not None
+        assert recovered.current_step == "awaiting_upload"
+
+    run(scenario())
+
+
+# ---------------------------------------------------------------------------
+# Incremental history log
+# ---------------------------------------------------------------------------
+
+class FakeRedis:
+    """Just enough of redis.asyncio for RedisPersistenceLayer"""
+
+    def __init__(self):
+        self.values = {}
+        self.lists = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def setex(self, key, ttl, value):
+        self.values[key] = value
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+            self.lists.pop(key, None)
+
+    async def rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+        return len(self.lists[key])
+
+    async def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    async def expire(self, key, ttl):
+        return 1
+
+    async def lrange(self, key, start, end):
+        return list(self.lists.get(key, []))
+
+    async def scan_iter(self, match="*", count=None):
+        for key in [*self.values, *self.lists]:
+            yield key.encode()
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self._redis = redis
+        self._commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __getattr__(self, name):
+        def queue(*args):
+            self._commands.append((name, args))
+        return queue
+
+    async def execute(self):
+        self._redis.round_trips += 1
+        return [await getattr(self._redis, name)(*args) for name, args in self._commands]
+
+
+def file_layer_factory(tmp_path):
+    return lambda: FilePersistenceLayer(str(tmp_path))
+
+
+def redis_layer_factory(tmp_path):
+    redis = FakeRedis()
+
+    def make():
+        layer = RedisPersistenceLayer()
+        layer._redis = redis
+        layer._connected = True
+        return layer
+    return make
+
+
+LAYER_FACTORIES = [file_layer_factory, redis_layer_factory]
+
+
+def history_of(state):
+    return [entry["n"] for entry in state.conversation_history]
+
+
+@pytest.mark.parametrize("factory", LAYER_FACTORIES)
+def test_history_appends_round_trip(tmp_path, factory):
+    async def scenario():
+        make = factory(tmp_path)
+        layer = make()
+        state = make_state()
+        for n in range(5):
+            state.conversation_history.append({"n": n})
+            assert await layer.save("user:1", state)
+
+        assert history_of(await make().load("user:1")) == [0, 1, 2, 3, 4]
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("factory", LAYER_FACTORIES)
+def test_history_trimmed_window_round_trip(tmp_path, factory):
+    async def scenario():
+        make = factory(tmp_path)
+        layer = make()
+        state = make_state(history=[{"n": 0}, {"n": 1}, {"n": 2}])
+        await layer.save("user:1", state)
+
+        # Fixed-size window: drop the oldest entry, append a new one
+        state.conversation_history = state.conversation_history[1:] + [{"n": 3}]
+        await layer.save("user:1", state)
+
+        assert history_of(await make().load("user:1")) == [1, 2, 3]
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("factory", LAYER_FACTORIES)
+def test_history_in_place_edit_round_trip(tmp_path, factory):
+    async def scenario():
+        make = factory(tmp_path)
+        layer = make()
+        state = make_state(history=[{"n": 0}, {"n": 1}])
+        await layer.save("user:1", state)
+
+        state.conversation_history[0]["n"] = 10
+        await layer.save("user:1", state)
+        state.conversation_history.append({"n": 2})
+        await layer.save("user:1", state)
+
+        assert history_of(await make().load("user:1")) == [10, 1, 2]
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("factory", LAYER_FACTORIES)
+def test_history_save_after_reload_appends(tmp_path, factory):
+    async def scenario():
+        make = factory(tmp_path)
+        await make().save("user:1", make_state(history=[{"n": 0}]))
+
+        layer = make()
+        state = await layer.load("user:1")
+        state.conversation_history.append({"n": 1})
+        await layer.save("user:1", state)
+
+        assert history_of(await make().load("user:1")) == [0, 1]
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("factory", LAYER_FACTORIES)
+def test_history_concurrent_load_and_save(tmp_path, factory):
+    async def scenario():
+        make = factory(tmp_path)
+        layer = make()
+        state = make_state(history=[{"n": 0}])
+        await layer.save("user:1", state)
+
+        state.conversation_history.append({"n": 1})
+        await asyncio.gather(layer.load("user:1"), layer.save("user:1", state))
+        state.conversation_history.append({"n": 2})
+        await layer.save("user:1", state)
+
+        assert history_of(await make().load("user:1")) == [0, 1, 2]
+
+    run(scenario())
+
+
+def raw_record(layer, key):
+    if isinstance(layer, RedisPersistenceLayer):
+        return layer._redis.values[key]
+    return layer._get_file_path(key).read_bytes()
+
+
+def put_raw_record(layer, key, record):
+    if isinstance(layer, RedisPersistenceLayer):
+        layer._redis.values[key] = record
+    else:
+        layer._get_file_path(key).write_bytes(record)
+
+
+@pytest.mark.skipif(not ZSTD_AVAILABLE, reason="zstandard is not installed")
+@pytest.mark.parametrize("factory", LAYER_FACTORIES)
+def test_large_record_round_trips_compressed(tmp_path, factory):
+    async def scenario():
+        make = factory(tmp_path)
+        state = make_state(history=[{"n": 0}])
+        state.extracted_data = {
+            "line_items": [{"sku": n, "description": "widget " * 20} for n in range(50)]
+        }
+        layer = make()
+        assert await layer.save("user:1", state)
+        
+        record = raw_record(layer, "user:1")
+        assert record[:1] == b"Z"
+        assert len(record) < len(state.to_record())
+        loaded = await make().load("user:1")
+        assert loaded.extracted_data == state.extracted_data
+        assert history_of(loaded) == [0]
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("factory", LAYER_FACTORIES)
+def test_legacy_plain_json_record_is_read(tmp_path, factory):
+    async def scenario():
+        make = factory(tmp_path)
+        # Records written before compression and the history log: plain
+        # JSON with the history embedded
+        legacy = make_state(history=[{"n": 0}, {"n": 1}])
+        legacy.current_step = "awaiting_upload"
+        put_raw_record(make(), "user:1", legacy.to_json(pretty=True))
+        
+        layer = make()
+        state = await layer.load("user:1")
+        assert state.current_step == "awaiting_upload"
+        assert history_of(state) == [0, 1]
+        
+        # The next save moves the embedded history into the log
+        state.conversation_history.append({"n": 2})
+        assert await layer.save("user:1", state)
+        assert history_of(await make().load("user:1")) == [0, 1, 2]
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("damaged", [0, 1, 2])
+@pytest.mark.parametrize("pad", [0, 4096])  # Large logs are read from an mmap
+def test_damaged_history_entry_keeps_the_rest_of_the_state(tmp_path, damaged, pad):
+    async def scenario():
+        layer = FilePersistenceLayer(str(tmp_path))
+        state = make_state(history=[{"n": n, "pad": "x" * pad} for n in range(3)])
+        state.current_step = "awaiting_confirmation"
+        state.pending_invoice = {"amount": 10}
+        await layer.save("user:1", state)
+        
+        log_path = layer._get_file_path("user:1").with_suffix(".history.ndjson")
+        lines = log_path.read_bytes().split(b"\n")
+        lines[damaged] = b'{"n": '
+        log_path.write_bytes(b"\n".join(lines))
+        
+        layer = FilePersistenceLayer(str(tmp_path))
+        loaded = await layer.load("user:1")
+        assert loaded.current_step == "awaiting_confirmation"
+        assert loaded.pending_invoice == {"amount": 10}
+        assert history_of(loaded) == list(range(damaged))
+        
+        # The next save rewrites the log instead of appending to it
+        loaded.conversation_history.append({"n": 9, "pad": ""})
+        await layer.save("user:1", loaded)
+        reloaded = await FilePersistenceLayer(str(tmp_path)).load("user:1")
+        assert history_of(reloaded) == list(range(damaged)) + [9]
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("appended", [[], [{"n": 2}]])
+def test_redis_history_rewritten_after_list_expired(tmp_path, appended):
+    async def scenario():
+        make = redis_layer_factory(tmp_path)
+        layer = make()
+        state = make_state(history=[{"n": 0}, {"n": 1}])
+        await layer.save("user:1", state)
+        
+        # The list's TTL ran out while this process still holds its mark
+        layer._redis.lists.clear()
+        state.conversation_history.extend(appended)
+        state.current_step = "changed"
+        await layer.save("user:1", state)
+        
+        assert history_of(await make().load("user:1")) == [0, 1] + [e["n"] for e in appended]
+
+    run(scenario())
+
+
+def test_redis_save_many_is_one_round_trip(tmp_path):
+    async def scenario():
+        make = redis_layer_factory(tmp_path)
+        layer = make()
+        states = {
+            f"user:{n}": make_state(f"user:{n}", history=[{"n": n}])
+            for n in range(5)
+        }
+        assert await layer.save_many(states)
+        assert layer._redis.round_trips == 1
+        
+        assert sorted(await layer.get_all_keys()) == sorted(states)
+        for key, state in states.items():
+            assert history_of(await make().load(key)) == history_of(state)
+
+    run(scenario())
+
+
+def test_redis_save_many_rewrites_only_expired_lists(tmp_path):
+    async def scenario():
+        make = redis_layer_factory(tmp_path)
+        layer = make()
+        states = {
+            key: make_state(key, history=[{"n": 0}])
+            for key in ("user:1", "user:2")
+        }
+        assert await layer.save_many(states)
+        
+        del layer._redis.lists["user:1" + ":history"]
+        for state in states.values():
+            state.conversation_history.append({"n": 1})
+        assert await layer.save_many(states)
+        
+        for key in states:
+            assert history_of(await make().load(key)) == [0, 1]
+
+    run(scenario())
@@ -0,0 +1,86 @@
+"""
+User Messages - Tests
+Covers template sharing, keyboard/action serialization and formatting.
+"""
+
+import json
+import os
+import sys
+from dataclasses import asdict
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import user_messages
+from user_messages import (
+    MESSAGES, UserMessageManager, format_for_telegram, get_help_keyboard, get_message,
+    get_retry_keyboard, _template
+)
+
+
+def test_keyboards_serialize_to_bot_api_json():
+    for keyboard in (get_retry_keyboard(), get_help_keyboard()):
+        payload = json.loads(json.dumps({"inline_keyboard": keyboard}))
+        for row in payload["inline_keyboard"]:
+            for button in row:
+                assert set(button) == {"text", "callback_data"}
+
+
+def test_keyboards_are_shared():
+    assert UserMessageManager.get_retry_keyboard() is get_retry_keyboard()
+    assert UserMessageManager.get_help_keyboard() is get_help_keyboard()
+
+
+def test_actions_serialize():
+    message = get_message("unknown_command")
+    actions = json.loads(json.dumps(list(message.actions)))
+    assert [action["callback"] for action in actions] == ["upload", "list", "help"]
+    assert list(asdict(message)["actions"]) == actions
+
+
+def test_every_template_converts_with_asdict():
+    for message in MESSAGES.values():
+        json.dumps(asdict(message))
+
+
+def test_get_message_returns_shared_template():
+    assert get_message("recovering") is MESSAGES["recovering"]
+    assert get_message("no_such_key") is MESSAGES["general_error"]
+
+
+def test_format_for_telegram_includes_emoji_and_follow_up():
+    text = format_for_telegram(get_message("ai_model_unavailable"))
+    assert text.startswith("🧠 My AI systems")
+    assert text.endswith("\n\nI'm still here to help you with your invoices!")
+
+
+@pytest.mark.parametrize("format_args", [
+    {"count": 1},           # KeyError for user
+    {"user": None},         # AttributeError
+    {"user": object()},     # AttributeError on .name
+    {"count": "x"},         # ValueError from the :d spec
+])
+def test_get_message_keeps_template_when_formatting_fails(monkeypatch, format_args):
+    greeting = _template("Hi {user.name}, {count:d} invoices", "info")
+    monkeypatch.setattr(user_messages, "MESSAGES", {"greeting": greeting})
+    assert get_message("greeting", **format_args) is greeting
+
+
+def test_get_message_keeps_template_on_type_error(monkeypatch):
+    class BadFormat:
+        def __format__(self, spec):
+            raise TypeError("unformattable")
+
+    greeting = _template("Hi {user}", "info")
+    monkeypatch.setattr(user_messages, "MESSAGES", {"greeting": greeting})
+    assert get_message("greeting", user=BadFormat()) is greeting
+    assert get_message("greeting", user="Ann").text == "Hi Ann"
+
+
+def test_category_formats_as_its_value():
+    category = get_message("recovering").category
+    assert category == "recovery"
+    assert str(category) == f"{category}" == "%s" % category == "recovery"
+    assert json.dumps({"category": category}) == '{"category": "recovery"}'
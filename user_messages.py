@@ -9,13 +9,16 @@ This module ensures that users always receive helpful, friendly messages
 regardless of what technical errors occur behind the scenes.
 """
 
-from typing import Dict, Optional, List
-from dataclasses import dataclass, field
-from enum import Enum
+import sys
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, Final, Iterable, Mapping, Optional, Tuple
+from dataclasses import dataclass, field, replace
+from enum import StrEnum
 
 
-class UserMessageCategory(Enum):
-    """Categories of user-facing messages"""
+class UserMessageCategory(StrEnum):
+    """Categories of user-facing messages (members are their string values)"""
     TECHNICAL_ISSUE = "technical_issue"
     USER_ERROR = "user_error"
     EXTERNAL_SERVICE = "external_service"
@@ -23,302 +26,365 @@ class UserMessageCategory(Enum):
     INFORMATION = "information"
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class UserMessage:
-    """Structured user message"""
+    """Structured user message (immutable - templates are shared, not copied)"""
     text: str
     category: UserMessageCategory
     show_retry_button: bool = False
     show_help_button: bool = False
     emoji: str = ""
     follow_up: Optional[str] = None
-    actions: List[Dict] = field(default_factory=list)
+    actions: Tuple[Dict[str, str], ...] = ()
+    # Telegram text, rendered once when the message is built
+    _rendered: str = field(default="", init=False, repr=False, compare=False)
+    # Whether text has str.format placeholders (no other text needs formatting)
+    _has_placeholders: bool = field(default=False, init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        object.__setattr__(self, "_rendered", _render(self))
+        object.__setattr__(self, "_has_placeholders", "{" in self.text)
 
 
-class UserMessageManager:
+def _render(message: UserMessage) -> str:
+    """Build the Telegram text for a message"""
+    emoji = message.emoji
+    follow_up = message.follow_up
+    if emoji and follow_up:
+        return f"{emoji} {message.text} \n\n{follow_up}"
+    if emoji:
+        return f"{emoji} {message.text}"
+    if follow_up:
+        return f"{message.text} \n\n{follow_up}"
+    return message.text
+
+
+def _button(text: str, callback_data: str) -> Dict[str, str]:
+    """Keyboard button with interned strings"""
+    return {"text": sys.intern(text), "callback_data": sys.intern(callback_data)}
+
+
+# Inline keyboards, built once and shared by every message: plain dicts so
+# they serialize straight to Bot API JSON - callers must not mutate them
+_RETRY_KEYBOARD = ((
+    _button("🔄 Try Again", "retry"),
+    _button("❓ Help", "help"),
+),)
+
+_HELP_KEYBOARD = ((
+    _button("📤 Upload Invoice", "upload"),
+    _button("📋 My Invoices", "list"),
+), (
+    _button("❓ How to Use", "help"),
+    _button("💬 Contact Support", "support"),
+))
+
+
+def _template(
+    text: str,
+    category: UserMessageCategory,
+    emoji: str = "",
+    follow_up: Optional[str] = None,
+    actions: Tuple[Dict[str, str], ...] = (),
+    **flags: bool
+) -> UserMessage:
+    """Build a shared template with its strings interned (repeats share one object)"""
+    return UserMessage(
+        text=sys.intern(text),
+        category=category,
+        emoji=sys.intern(emoji),
+        follow_up=sys.intern(follow_up) if follow_up else follow_up,
+        actions=tuple(
+            {key: sys.intern(value) for key, value in action.items()}
+            for action in actions
+        ),
+        **flags,
+    )
+
+
+# Message templates by category
+_MESSAGE_TEMPLATES = {
+    # AI Model Issues
+    "ai_model_timeout": _template(
+        text="I'm taking a bit longer than usual to think about this. Let me try again...",
+        category=UserMessageCategory.TECHNICAL_ISSUE,
+        emoji="🤔",
+        show_retry_button=True,
+    ),
+    "ai_model_rate_limit": _template(
+        text="I'm experiencing high demand right now. Please give me a moment...",
+        category=UserMessageCategory.TECHNICAL_ISSUE,
+        emoji="⏳",
+        show_retry_button=True,
+    ),
+    "ai_model_unavailable": _template(
+        text="My AI systems are temporarily unavailable. Let me use my backup brain!",
+        category=UserMessageCategory.TECHNICAL_ISSUE,
+        emoji="🧠",
+        follow_up="I'm still here to help you with your invoices!",
+    ),
+
+    # Document Processing Issues
+    "document_corrupted": _template(
+        text="I couldn't read that file. It might be corrupted or in an unsupported format.",
+        category=UserMessageCategory.USER_ERROR,
+        emoji="📄❌",
+        show_help_button=True,
+        follow_up="Could you try uploading a PDF, JPG, or PNG file?",
+    ),
+    "document_too_large": _template(
+        text="That file is too large for me to process. Please try a smaller file (under 20MB).",
+        category=UserMessageCategory.USER_ERROR,
+        emoji="📦",
+        follow_up="You could also try compressing the image or using a lower resolution.",
+    ),
+    "ocr_failed": _template(
+        text="I had trouble reading the text in that image. Could you try a clearer photo?",
+        category=UserMessageCategory.USER_ERROR,
+        emoji="🔍",
+        show_help_button=True,
+        follow_up="Tips: Make sure the image is well-lit and the text is clearly visible.",
+    ),
+
+    # Database Issues
+    "database_connection": _template(
+        text="I'm having trouble saving your data, but don't worry - your current session is safe!",
+        category=UserMessageCategory.TECHNICAL_ISSUE,
+        emoji="💾",
+        follow_up="I'll keep trying to save your information in the background.",
+    ),
+    "database_timeout": _template(
+        text="My database is taking longer than expected to respond...",
+        category=UserMessageCategory.TECHNICAL_ISSUE,
+        emoji="🔄",
+    ),
+
+    # Network Issues
+    "network_error": _template(
+        text="I'm having trouble connecting to my services. Let me retry...",
+        category=UserMessageCategory.TECHNICAL_ISSUE,
+        emoji="🌐",
+        show_retry_button=True,
+    ),
+    "download_failed": _template(
+        text="I couldn't download your file. Please try uploading it again.",
+        category=UserMessageCategory.TECHNICAL_ISSUE,
+        emoji="📥",
+        show_retry_button=True,
+    ),
+
+    # Webhook Issues
+    "webhook_failed": _template(
+        text="I couldn't notify external systems, but your invoice was processed successfully!",
+        category=UserMessageCategory.EXTERNAL_SERVICE,
+        emoji="📡",
+        follow_up="I'll retry sending the notification in the background.",
+    ),
+
+    # Third-Party Service Issues
+    "cloudconvert_failed": _template(
+        text="I had trouble converting that file format. Could you try a different file?",
+        category=UserMessageCategory.EXTERNAL_SERVICE,
+        emoji="🔄",
+        show_help_button=True,
+    ),
+    "google_sheets_failed": _template(
+        text="I couldn't save to Google Sheets, but your data is safely stored!",
+        category=UserMessageCategory.EXTERNAL_SERVICE,
+        emoji="📊",
+        follow_up="You can export your data anytime from the menu.",
+    ),
+    "external_api_down": _template(
+        text="An external service I use is temporarily down. I'll continue with what I can do!",
+        category=UserMessageCategory.EXTERNAL_SERVICE,
+        emoji="🔌",
+    ),
+
+    # User Input Issues
+    "invalid_input": _template(
+        text="I'm not sure I understood that. Could you rephrase or be more specific?",
+        category=UserMessageCategory.USER_ERROR,
+        emoji="🤷",
+        show_help_button=True,
+    ),
+    "unknown_command": _template(
+        text="I don't recognize that command. Here are some things I can help with:",
+        category=UserMessageCategory.USER_ERROR,
+        emoji="❓",
+        actions=(
+            {"text": "📤 Upload Invoice", "callback": "upload"},
+            {"text": "📋 View Invoices", "callback": "list"},
+            {"text": "❓ Help", "callback": "help"},
+        ),
+    ),
+
+    # Recovery Messages
+    "recovering": _template(
+        text="I'm recovering from a brief issue. Thanks for your patience!",
+        category=UserMessageCategory.RECOVERY,
+        emoji="🩹",
+    ),
+    "using_fallback": _template(
+        text="I'm using my backup systems to help you. Everything is working!",
+        category=UserMessageCategory.RECOVERY,
+        emoji="🔄",
+    ),
+    "state_recovered": _template(
+        text="Good news! I recovered your previous session. Let's continue!",
+        category=UserMessageCategory.RECOVERY,
+        emoji="✅",
+    ),
+
+    # General Messages
+    "general_error": _template(
+        text="I encountered a small hiccup, but I'm still here to help!",
+        category=UserMessageCategory.TECHNICAL_ISSUE,
+        emoji="⚠️",
+        show_retry_button=True,
+    ),
+    "working_on_it": _template(
+        text="I'm working on that for you...",
+        category=UserMessageCategory.INFORMATION,
+        emoji="⚙️",
+    ),
+    "almost_done": _template(
+        text="Almost done! Just a moment...",
+        category=UserMessageCategory.INFORMATION,
+        emoji="🏃",
+    ),
+}
+
+# Read-only at runtime; interned keys let lookups match on identity first
+MESSAGES: Final[Mapping[str, UserMessage]] = MappingProxyType({
+    sys.intern(key): message for key, message in _MESSAGE_TEMPLATES.items()
+})
+
+# Fallback for unknown keys
+_GENERAL_ERROR: Final[UserMessage] = MESSAGES["general_error"]
+
+# "error_category:error_type" -> message key
+_ERROR_MAP: Final[Dict[str, str]] = {
+    "ai_model:timeout": "ai_model_timeout",
+    "ai_model:rate_limit": "ai_model_rate_limit",
+    "ai_model:unavailable": "ai_model_unavailable",
+    "document_processing:corrupted": "document_corrupted",
+    "document_processing:too_large": "document_too_large",
+    "document_processing:ocr": "ocr_failed",
+    "database:connection": "database_connection",
+    "database:timeout": "database_timeout",
+    "network:error": "network_error",
+    "file_download:failed": "download_failed",
+    "webhook:failed": "webhook_failed",
+    "third_party:cloudconvert": "cloudconvert_failed",
+    "third_party:google_sheets": "google_sheets_failed",
+    "third_party:api_down": "external_api_down",
+    "user_input:invalid": "invalid_input",
+    "user_input:unknown_command": "unknown_command",
+}
+
+# _ERROR_MAP resolved to the templates themselves
+_ERROR_TEMPLATES: Final[Mapping[str, UserMessage]] = MappingProxyType({
+    error_key: MESSAGES[message_key] for error_key, message_key in _ERROR_MAP.items()
+})
+
+
+def get_message(key: str, **format_args) -> UserMessage:
     """
-    Manages user-friendly error messages
-    Converts technical errors to helpful, non-technical responses
+    Get a user message by key
+    
+    Returns the shared template itself unless there is text to format.
     """
+    message = MESSAGES.get(key, _GENERAL_ERROR)
+    if not format_args or not message._has_placeholders:
+        return message
     
-    # Message templates by category
-    MESSAGES = {
-        # AI Model Issues
-        "ai_model_timeout": UserMessage(
-            text="I'm taking a bit longer than usual to think about this. Let me try again...",
-            category=UserMessageCategory.TECHNICAL_ISSUE,
-            emoji="🤔",
-            show_retry_button=True,
-        ),
-        "ai_model_rate_limit": UserMessage(
-            text="I'm experiencing high demand right now. Please give me a moment...",
-            category=UserMessageCategory.TECHNICAL_ISSUE,
-            emoji="⏳",
-            show_retry_button=True,
-        ),
-        "ai_model_unavailable": UserMessage(
-            text="My AI systems are temporarily unavailable. Let me use my backup brain!",
-            category=UserMessageCategory.TECHNICAL_ISSUE,
-            emoji="🧠",
-            follow_up="I'm still here to help you with your invoices!",
-        ),
-        
-        # Document Processing Issues
-        "document_corrupted": UserMessage(
-            text="I couldn't read that file. It might be corrupted or in an unsupported format.",
-            category=UserMessageCategory.USER_ERROR,
-            emoji="📄❌",
-            show_help_button=True,
-            follow_up="Could you try uploading a PDF, JPG, or PNG file?",
-        ),
-        "document_too_large": UserMessage(
-            text="That file is too large for me to process. Please try a smaller file (under 20MB).",
-            category=UserMessageCategory.USER_ERROR,
-            emoji="📦",
-            follow_up="You could also try compressing the image or using a lower resolution.",
-        ),
-        "ocr_failed": UserMessage(
-            text="I had trouble reading the text in that image. Could you try a clearer photo?",
-            category=UserMessageCategory.USER_ERROR,
-            emoji="🔍",
-            show_help_button=True,
-            follow_up="Tips: Make sure the image is well-lit and the text is clearly visible.",
-        ),
-        
-        # Database Issues
-        "database_connection": UserMessage(
-            text="I'm having trouble saving your data, but don't worry - your current session is safe!",
-            category=UserMessageCategory.TECHNICAL_ISSUE,
-            emoji="💾",
-            follow_up="I'll keep trying to save your information in the background.",
-        ),
-        "database_timeout": UserMessage(
-            text="My database is taking longer than expected to respond...",
-            category=UserMessageCategory.TECHNICAL_ISSUE,
-            emoji="🔄",
-        ),
-        
-        # Network Issues
-        "network_error": UserMessage(
-            text="I'm having trouble connecting to my services. Let me retry...",
-            category=UserMessageCategory.TECHNICAL_ISSUE,
-            emoji="🌐",
-            show_retry_button=True,
-        ),
-        "download_failed": UserMessage(
-            text="I couldn't download your file. Please try uploading it again.",
-            category=UserMessageCategory.TECHNICAL_ISSUE,
-            emoji="📥",
-            show_retry_button=True,
-        ),
-        
-        # Webhook Issues
-        "webhook_failed": UserMessage(
-            text="I couldn't notify external systems, but your invoice was processed successfully!",
-            category=UserMessageCategory.EXTERNAL_SERVICE,
-            emoji="📡",
-            follow_up="I'll retry sending the notification in the background.",
-        ),
-        
-        # Third-Party Service Issues
-        "cloudconvert_failed": UserMessage(
-            text="I had trouble converting that file format. Could you try a different file?",
-            category=UserMessageCategory.EXTERNAL_SERVICE,
-            emoji="🔄",
-            show_help_button=True,
-        ),
-        "google_sheets_failed": UserMessage(
-            text="I couldn't save to Google Sheets, but your data is safely stored!",
-            category=UserMessageCategory.EXTERNAL_SERVICE,
-            emoji="📊",
-            follow_up="You can export your data anytime from the menu.",
-        ),
-        "external_api_down": UserMessage(
-            text="An external service I use is temporarily down. I'll continue with what I can do!",
-            category=UserMessageCategory.EXTERNAL_SERVICE,
-            emoji="🔌",
-        ),
-        
-        # User Input Issues
-        "invalid_input": UserMessage(
-            text="I'm not sure I understood that. Could you rephrase or be more specific?",
-            category=UserMessageCategory.USER_ERROR,
-            emoji="🤷",
-            show_help_button=True,
-        ),
-        "unknown_command": UserMessage(
-            text="I don't recognize that command. Here are some things I can help with:",
-            category=UserMessageCategory.USER_ERROR,
-            emoji="❓",
-            actions=[
-                {"text": "📤 Upload Invoice", "callback": "upload"},
-                {"text": "📋 View Invoices", "callback": "list"},
-                {"text": "❓ Help", "callback": "help"},
-            ],
-        ),
-        
-        # Recovery Messages
-        "recovering": UserMessage(
-            text="I'm recovering from a brief issue. Thanks for your patience!",
-            category=UserMessageCategory.RECOVERY,
-            emoji="🩹",
-        ),
-        "using_fallback": UserMessage(
-            text="I'm using my backup systems to help you. Everything is working!",
-            category=UserMessageCategory.RECOVERY,
-            emoji="🔄",
-        ),
-        "state_recovered": UserMessage(
-            text="Good news! I recovered your previous session. Let's continue!",
-            category=UserMessageCategory.RECOVERY,
-            emoji="✅",
-        ),
-        
-        # General Messages
-        "general_error": UserMessage(
-            text="I encountered a small hiccup, but I'm still here to help!",
-            category=UserMessageCategory.TECHNICAL_ISSUE,
-            emoji="⚠️",
-            show_retry_button=True,
-        ),
-        "working_on_it": UserMessage(
-            text="I'm working on that for you...",
-            category=UserMessageCategory.INFORMATION,
-            emoji="⚙️",
-        ),
-        "almost_done": UserMessage(
-            text="Almost done! Just a moment...",
-            category=UserMessageCategory.INFORMATION,
-            emoji="🏃",
-        ),
-    }
+    # Format the text with provided arguments
+    try:
+        text = message.text.format(**format_args)
+    except Exception:
+        return message  # Keep original if formatting fails
     
-    @classmethod
-    def get_message(cls, key: str, **format_args) -> UserMessage:
-        """Get a user message by key"""
-        message = cls.MESSAGES.get(key, cls.MESSAGES["general_error"])
-        
-        # Format the text with provided arguments
-        text = message.text
-        if format_args:
-            try:
-                text = text.format(**format_args)
-            except:
-                pass  # Keep original if formatting fails
-        
-        # Create a copy with formatted text
-        return UserMessage(
-            text=text,
-            category=message.category,
-            show_retry_button=message.show_retry_button,
-            show_help_button=message.show_help_button,
-            emoji=message.emoji,
-            follow_up=message.follow_up,
-            actions=message.actions.copy() if message.actions else [],
-        )
+    return replace(message, text=text)
+
+
+# The error taxonomy is closed, so every (category, type) pair is looked up once
+@lru_cache(maxsize=64)
+def get_message_for_error(
+    error_category: str,
+    error_type: str,
+    is_retryable: bool = True
+) -> UserMessage:
+    """
+    Get appropriate user message for an error
     
-    @classmethod
-    def get_message_for_error(
-        cls,
-        error_category: str,
-        error_type: str,
-        is_retryable: bool = True
-    ) -> UserMessage:
-        """
-        Get appropriate user message for an error
-        
-        Args:
-            error_category: Category of error (ai_model, database, network, etc.)
-            error_type: Type of error (timeout, rate_limit, etc.)
-            is_retryable: Whether the error is retryable
-        """
-        # Map error categories to message keys
-        error_map = {
-            ("ai_model", "timeout"): "ai_model_timeout",
-            ("ai_model", "rate_limit"): "ai_model_rate_limit",
-            ("ai_model", "unavailable"): "ai_model_unavailable",
-            ("document_processing", "corrupted"): "document_corrupted",
-            ("document_processing", "too_large"): "document_too_large",
-            ("document_processing", "ocr"): "ocr_failed",
-            ("database", "connection"): "database_connection",
-            ("database", "timeout"): "database_timeout",
-            ("network", "error"): "network_error",
-            ("file_download", "failed"): "download_failed",
-            ("webhook", "failed"): "webhook_failed",
-            ("third_party", "cloudconvert"): "cloudconvert_failed",
-            ("third_party", "google_sheets"): "google_sheets_failed",
-            ("third_party", "api_down"): "external_api_down",
-            ("user_input", "invalid"): "invalid_input",
-            ("user_input", "unknown_command"): "unknown_command",
-        }
-        
-        key = error_map.get((error_category, error_type), "general_error")
-        return cls.get_message(key)
+    Args:
+        error_category: Category of error (ai_model, database, network, etc.)
+        error_type: Type of error (timeout, rate_limit, etc.)
+        is_retryable: Whether the error is retryable
+    """
+    return _ERROR_TEMPLATES.get(f"{error_category}:{error_type}", _GENERAL_ERROR)
+
+
+def format_for_telegram(message: UserMessage) -> str:
+    """Format a message for Telegram"""
+    return message._rendered
+
+
+def get_retry_keyboard() -> Tuple[Tuple[Dict[str, str], ...], ...]:
+    """Get retry keyboard layout (shared - don't mutate)"""
+    return _RETRY_KEYBOARD
+
+
+def get_help_keyboard() -> Tuple[Tuple[Dict[str, str], ...], ...]:
+    """Get help keyboard layout (shared - don't mutate)"""
+    return _HELP_KEYBOARD
+
+
+class UserMessageManager:
+    """
+    Manages user-friendly error messages
+    Converts technical errors to helpful, non-technical responses
     
-    @classmethod
-    def format_for_telegram(cls, message: UserMessage) -> str:
-        """Format a message for Telegram"""
-        parts = []
-        
-        if message.emoji:
-            parts.append(message.emoji)
-        
-        parts.append(message.text)
-        
-        if message.follow_up:
-            parts.append(f"\n\n{message.follow_up}")
-        
-        return " ".join(parts)
+    Namespace kept for existing callers; the module-level functions are
+    the same objects and skip the class attribute lookup.
+    """
     
-    @classmethod
-    def get_retry_keyboard(cls) -> List[List[Dict]]:
-        """Get retry keyboard layout"""
-        return [[
-            {"text": "🔄 Try Again", "callback_data": "retry"},
-            {"text": "❓ Help", "callback_data": "help"},
-        ]]
+    MESSAGES = MESSAGES
     
-    @classmethod
-    def get_help_keyboard(cls) -> List[List[Dict]]:
-        """Get help keyboard layout"""
-        return [[
-            {"text": "📤 Upload Invoice", "callback_data": "upload"},
-            {"text": "📋 My Invoices", "callback_data": "list"},
-        ], [
-            {"text": "❓ How to Use", "callback_data": "help"},
-            {"text": "💬 Contact Support", "callback_data": "support"},
-        ]]
+    get_message = staticmethod(get_message)
+    get_message_for_error = staticmethod(get_message_for_error)
+    format_for_telegram = staticmethod(format_for_telegram)
+    get_retry_keyboard = staticmethod(get_retry_keyboard)
+    get_help_keyboard = staticmethod(get_help_keyboard)
 
 
 class MessageBuilder:
     """Builds complex messages with multiple parts"""
     
     def __init__(self):
+        # (kind, text, extra) fragments - formatted only in build()
         self.parts = []
         self.emoji = ""
         self.actions = []
     
     def add_text(self, text: str, emoji: str = ""):
         """Add text part"""
-        if emoji:
-            self.parts.append(f"{emoji} {text}")
-        else:
-            self.parts.append(text)
+        self.parts.append(("text", text, emoji))
         return self
     
     def add_line_break(self):
         """Add line break"""
-        self.parts.append("")
+        self.parts.append(("break", "", None))
         return self
     
     def add_bullet(self, text: str):
         """Add bullet point"""
-        self.parts.append(f"• {text}")
+        self.parts.append(("bullet", text, None))
         return self
     
     def add_numbered(self, number: int, text: str):
         """Add numbered item"""
-        self.parts.append(f"{number}. {text}")
+        self.parts.append(("num", text, number))
         return self
     
     def add_action(self, text: str, callback: str):
@@ -328,32 +394,67 @@ class MessageBuilder:
     
     def build(self) -> str:
         """Build the final message"""
-        return "\n".join(self.parts)
+        return self._join(self.parts)
+    
+    @classmethod
+    def from_iterable(cls, items: Iterable[Tuple[str, str, Any]]) -> str:
+        """
+        Build a message in one shot from (kind, text, extra) fragments
+        
+        Kinds mirror the add_* methods: ("text", text, emoji),
+        ("bullet", text, None), ("num", text, number) and ("break", "", None).
+        """
+        return cls._join(items)
+    
+    @staticmethod
+    def _join(fragments: Iterable[Tuple[str, str, Any]]) -> str:
+        """Format fragments and join them in a single pass"""
+        out = []
+        append = out.append
+        for kind, text, extra in fragments:
+            if kind == "bullet":
+                append("• ")
+            elif kind == "num":
+                append(str(extra))
+                append(". ")
+            elif kind == "text" and extra:
+                append(extra)
+                append(" ")
+            append(text)
+            append("\n")
+        if out:
+            out.pop()  # No newline after the last line
+        return "".join(out)
 
 
 # Pre-built message sequences for common scenarios
+_RECOVERY_SEQUENCE: Tuple[UserMessage, ...] = (
+    MESSAGES["recovering"],
+    MESSAGES["using_fallback"],
+)
+
+_DOCUMENT_UPLOAD_HELP: Tuple[str, ...] = (
+    "📄 **Supported Formats:** PDF, JPG, PNG",
+    "📏 **Size Limit:** 20MB maximum",
+    "💡 **Tips for best results:**",
+    "   • Use well-lit, clear images",
+    "   • Make sure text is readable",
+    "   • Avoid blurry or skewed photos",
+)
+
+
 class MessageSequences:
     """Pre-built message sequences for complex interactions"""
     
     @staticmethod
-    def recovery_sequence() -> List[UserMessage]:
+    def recovery_sequence() -> Tuple[UserMessage, ...]:
         """Message sequence for system recovery"""
-        return [
-            UserMessageManager.get_message("recovering"),
-            UserMessageManager.get_message("using_fallback"),
-        ]
+        return _RECOVERY_SEQUENCE
     
     @staticmethod
-    def document_upload_help() -> List[str]:
+    def document_upload_help() -> Tuple[str, ...]:
         """Help messages for document upload issues"""
-        return [
-            "📄 **Supported Formats:** PDF, JPG, PNG",
-            "📏 **Size Limit:** 20MB maximum",
-            "💡 **Tips for best results:**",
-            "   • Use well-lit, clear images",
-            "   • Make sure text is readable",
-            "   • Avoid blurry or skewed photos",
-        ]
+        return _DOCUMENT_UPLOAD_HELP
     
     @staticmethod
     def fallback_capabilities() -> str: